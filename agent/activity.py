@@ -2,11 +2,11 @@
 
 import logging
 import threading
-import time
 from collections.abc import Callable
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from .config import ActivityConfig
     from .platform.base import PlatformBase
 
 log = logging.getLogger(__name__)
@@ -20,26 +20,38 @@ class ActivityMonitor:
         platform: "PlatformBase",
         poll_interval: int,
         on_activity: Callable[[str | None, int], None],
+        idle_threshold_minutes: int = 0,
     ):
         self.platform = platform
         self.poll_interval = poll_interval
         self.on_activity = on_activity
-        self._running = False
+        self.idle_threshold_seconds = idle_threshold_minutes * 60  # 0 = disabled
+        self._stop_event = threading.Event()
         self._thread: threading.Thread | None = None
 
+    @classmethod
+    def from_config(
+        cls,
+        platform: "PlatformBase",
+        config: "ActivityConfig",
+        on_activity: Callable[[str | None, int], None],
+    ) -> "ActivityMonitor":
+        """Create a monitor using the configured poll interval and idle threshold."""
+        return cls(platform, config.poll_interval, on_activity, config.idle_threshold_minutes)
+
     def start(self) -> None:
         """Start the activity monitor."""
-        if self._running:
+        if self._thread:
             return
 
-        self._running = True
+        self._stop_event.clear()
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
         log.info(f"Activity monitor started (interval={self.poll_interval}s)")
 
     def stop(self) -> None:
         """Stop the activity monitor."""
-        self._running = False
+        self._stop_event.set()
         if self._thread:
             self._thread.join(timeout=5)
             self._thread = None
@@ -47,16 +59,17 @@ class ActivityMonitor:
 
     def _run(self) -> None:
         """Main monitoring loop."""
-        while self._running:
+        while not self._stop_event.is_set():
             try:
-                active_window = self.platform.get_active_window()
                 idle_seconds = self.platform.get_idle_seconds()
+                # The window title is not used while idle, so skip querying it
+                if 0 < self.idle_threshold_seconds < idle_seconds:
+                    active_window = None
+                else:
+                    active_window = self.platform.get_active_window()
                 self.on_activity(active_window, idle_seconds)
             except Exception as e:
                 log.error(f"Activity monitor error: {e}")
 
-            # Sleep in small increments to allow quick shutdown
-            for _ in range(self.poll_interval * 10):
-                if not self._running:
-                    break
-                time.sleep(0.1)
+            # Wait for the next poll; returns immediately once stop() is called
+            self._stop_event.wait(self.poll_interval)
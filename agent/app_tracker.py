@@ -2,77 +2,106 @@
 
 import logging
 import re
-from datetime import date, datetime
+import time
+from collections import Counter, defaultdict
+from datetime import date
+from functools import lru_cache
 
 log = logging.getLogger(__name__)
 
+# How often to check for a date change (seconds)
+DAY_CHECK_INTERVAL = 60.0
+
+# Browser window titles end in the browser name; map them to a short app name
+BROWSER_PATTERNS = [
+    (re.compile(r".* [-\u2014] (Mozilla Firefox|Firefox)$", re.IGNORECASE), "Firefox"),
+    (re.compile(r".* [-\u2014] (Google Chrome|Chromium)$", re.IGNORECASE), "Chrome"),
+    (re.compile(r".* [-\u2014] (Brave)$", re.IGNORECASE), "Brave"),
+    (re.compile(r".* [-\u2014] (Microsoft Edge)$", re.IGNORECASE), "Edge"),
+]
+
+
+@lru_cache(maxsize=1024)
+def extract_app_name(window_title: str) -> str:
+    """Extract app name from window title.
+
+    Tries to extract the application name from common window title formats:
+    - "Document - Application" -> "Application"
+    - "Application: Document" -> "Application"
+    - "Application" -> "Application"
+
+    Results are memoized since the same titles recur constantly while a
+    window stays focused.
+    """
+    if not window_title:
+        return "Unknown"
+
+    # Common browser patterns
+    for pattern, name in BROWSER_PATTERNS:
+        if pattern.match(window_title):
+            return name
+
+    # Common patterns: "Title - Application" or "Title \u2014 Application"
+    # (em-dash); the rightmost separator of either kind wins
+    idx = max(window_title.rfind(" - "), window_title.rfind(" \u2014 "))
+    if idx != -1:
+        app = window_title[idx + 3:].strip()
+        if app:
+            return app
+
+    # Pattern: "Application: Title"
+    idx = window_title.find(": ")
+    if idx != -1:
+        app = window_title[:idx].strip()
+        if app:
+            return app
+
+    # Fallback: use the whole title, truncated
+    return window_title[:50] if len(window_title) > 50 else window_title
+
+
+class _UserAppState:
+    """Per-user tracking state (current window and today's usage)."""
+
+    __slots__ = ("window", "start", "app_name", "usage")
+
+    def __init__(self):
+        # Current window title and app name, if any
+        self.window: str | None = None
+        self.app_name: str | None = None
+        # When current window started (time.monotonic() seconds)
+        self.start: float = 0.0
+        # Usage today: {app_name: seconds}
+        self.usage: Counter[str] = Counter()
+
 
 class AppTracker:
     """Tracks application usage by monitoring active window titles."""
 
     def __init__(self):
-        # Current window per user
-        self._current_windows: dict[str, str] = {}
-        # When current window started
-        self._current_start: dict[str, datetime] = {}
-        # Daily usage per user: {username: {app_name: seconds}}
-        self._daily_usage: dict[str, dict[str, int]] = {}
-        # Track which date the usage is for
-        self._usage_date: str | None = None
+        # Tracking state per user
+        self._users: defaultdict[str, _UserAppState] = defaultdict(_UserAppState)
+        # Track which date the usage is for (as a date ordinal)
+        self._usage_ordinal: int = -1
+        # Monotonic time of the next date check
+        self._next_day_check: float = 0.0
 
     def _reset_if_new_day(self) -> None:
         """Reset daily usage if it's a new day."""
-        today = date.today().isoformat()
-        if self._usage_date != today:
-            self._daily_usage.clear()
-            self._current_windows.clear()
-            self._current_start.clear()
-            self._usage_date = today
+        now = time.monotonic()
+        if now < self._next_day_check:
+            return
+        self._next_day_check = now + DAY_CHECK_INTERVAL
+
+        today = date.today().toordinal()
+        if self._usage_ordinal != today:
+            self._users.clear()
+            self._usage_ordinal = today
             log.debug("App tracker reset for new day")
 
     def _extract_app_name(self, window_title: str) -> str:
-        """Extract app name from window title.
-
-        Tries to extract the application name from common window title formats:
-        - "Document - Application" -> "Application"
-        - "Application: Document" -> "Application"
-        - "Application" -> "Application"
-        """
-        if not window_title:
-            return "Unknown"
-
-        # Common browser patterns
-        browser_patterns = [
-            (r".* [-\u2014] (Mozilla Firefox|Firefox)$", "Firefox"),
-            (r".* [-\u2014] (Google Chrome|Chromium)$", "Chrome"),
-            (r".* [-\u2014] (Brave)$", "Brave"),
-            (r".* [-\u2014] (Microsoft Edge)$", "Edge"),
-        ]
-
-        for pattern, name in browser_patterns:
-            if re.match(pattern, window_title, re.IGNORECASE):
-                return name
-
-        # Common patterns: "Title - Application"
-        if " - " in window_title:
-            parts = window_title.rsplit(" - ", 1)
-            if len(parts) == 2 and parts[1]:
-                return parts[1].strip()
-
-        # Pattern: "Title \u2014 Application" (em-dash)
-        if " \u2014 " in window_title:
-            parts = window_title.rsplit(" \u2014 ", 1)
-            if len(parts) == 2 and parts[1]:
-                return parts[1].strip()
-
-        # Pattern: "Application: Title"
-        if ": " in window_title:
-            parts = window_title.split(": ", 1)
-            if len(parts) == 2 and parts[0]:
-                return parts[0].strip()
-
-        # Fallback: use the whole title, truncated
-        return window_title[:50] if len(window_title) > 50 else window_title
+        """Extract app name from window title."""
+        return extract_app_name(window_title)
 
     def update(self, username: str, window_title: str | None) -> None:
         """Track window change and accumulate time for previous window.
@@ -83,31 +112,23 @@ class AppTracker:
         """
         self._reset_if_new_day()
 
-        now = datetime.now()
-        current_window = self._current_windows.get(username)
-        current_start = self._current_start.get(username)
+        state = self._users[username]
+        if window_title == state.window:
+            return
 
-        # If window changed, accumulate time for previous window
-        if current_window and current_start and current_window != window_title:
-            elapsed = (now - current_start).total_seconds()
+        now = time.monotonic()
+
+        # Window changed, accumulate time for previous window
+        if state.window:
+            elapsed = int(now - state.start)
             if elapsed > 0:
-                app_name = self._extract_app_name(current_window)
-                if username not in self._daily_usage:
-                    self._daily_usage[username] = {}
-                self._daily_usage[username][app_name] = (
-                    self._daily_usage[username].get(app_name, 0) + int(elapsed)
-                )
-                log.debug(f"User {username}: {app_name} +{int(elapsed)}s")
-
-        # Update current tracking
-        if window_title:
-            if window_title != current_window:
-                self._current_windows[username] = window_title
-                self._current_start[username] = now
-        else:
-            # No active window
-            self._current_windows.pop(username, None)
-            self._current_start.pop(username, None)
+                state.usage[state.app_name] += elapsed
+                log.debug(f"User {username}: {state.app_name} +{elapsed}s")
+
+        # Update current tracking (no active window clears it)
+        state.window = window_title or None
+        state.app_name = self._extract_app_name(window_title) if window_title else None
+        state.start = now
 
     def get_top_apps(self, username: str, limit: int = 5) -> list[tuple[str, int]]:
         """Return top apps by usage time for a user.
@@ -121,25 +142,23 @@ class AppTracker:
         """
         self._reset_if_new_day()
 
-        if username not in self._daily_usage:
+        state = self._users.get(username)
+        if state is None:
             return []
 
-        usage = self._daily_usage[username]
-        sorted_apps = sorted(usage.items(), key=lambda x: x[1], reverse=True)
-        return sorted_apps[:limit]
+        return state.usage.most_common(limit)
 
     def get_current_app(self, username: str) -> str | None:
         """Get the currently active app for a user."""
-        window = self._current_windows.get(username)
-        if window:
-            return self._extract_app_name(window)
-        return None
+        state = self._users.get(username)
+        return state.app_name if state else None
 
     def get_total_tracked_seconds(self, username: str) -> int:
         """Get total tracked time for a user today."""
         self._reset_if_new_day()
 
-        if username not in self._daily_usage:
+        state = self._users.get(username)
+        if state is None:
             return 0
 
-        return sum(self._daily_usage[username].values())
+        return state.usage.total()
@@ -16,12 +16,7 @@ class CommandHandler:
     def __init__(self, platform: "PlatformBase"):
         self.platform = platform
         self._shutdown_timer: threading.Timer | None = None
-
-    def handle(self, command: dict) -> None:
-        """Dispatch a command."""
-        action = command.get("action", "").lower()
-
-        handlers = {
+        self._handlers = {
             "lock": self._handle_lock,
             "unlock": self._handle_unlock,
             "shutdown": self._handle_shutdown,
@@ -29,7 +24,11 @@ class CommandHandler:
             "cancel": self._handle_cancel,
         }
 
-        handler = handlers.get(action)
+    def handle(self, command: dict) -> None:
+        """Dispatch a command."""
+        action = command.get("action", "").lower()
+
+        handler = self._handlers.get(action)
         if handler:
             handler(command)
         else:
@@ -1,10 +1,75 @@
 """Configuration handling for Kidlock agent."""
 
+import logging
+import os
 import socket
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from pathlib import Path
+from typing import IO, Any, TypeVar
 
-import yaml
+from . import fastjson
+
+T = TypeVar("T")
+
+log = logging.getLogger(__name__)
+
+# JSON copy of the last parsed config file (see Config.load_cached)
+CONFIG_CACHE_FILE = Path("/var/cache/kidlock/config.json")
+
+# Set once a cache write failure has been logged, so it is only reported once
+_cache_write_warned = False
+
+# Largest warning threshold accepted from config (minutes in a day)
+MAX_WARNING_MINUTES = 24 * 60
+
+
+def _load_yaml(stream: IO[bytes]) -> Any:
+    """Parse YAML using libyaml's CSafeLoader when available.
+
+    PyYAML is imported here rather than at module level so that importing the
+    config dataclasses (e.g. from enforcer or the PAM check) stays cheap.
+    """
+    import yaml
+
+    # CSafeLoader is only present when PyYAML was built against libyaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(stream, Loader=loader)
+
+
+def _from_dict(cls: type[T], data: dict | None, **overrides: Any) -> T:
+    """Build a config dataclass from a YAML mapping.
+
+    Keys matching a field of ``cls`` are passed through; missing keys keep the
+    dataclass defaults and unknown keys are ignored. ``overrides`` take
+    precedence over ``data`` (used for nested sections).
+    """
+    data = data or {}
+    kwargs = {
+        f.name: data[f.name]
+        for f in fields(cls)  # type: ignore[arg-type]
+        if f.name in data and f.name not in overrides
+    }
+    return cls(**kwargs, **overrides)
+
+
+def _write_cache(cache_file: Path, cache: dict) -> None:
+    """Atomically write the parsed config cache, readable by its owner only.
+
+    The config contains the MQTT password, hence the 0600 mode.
+    """
+    global _cache_write_warned
+    try:
+        payload = fastjson.dumps(cache)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(".json.tmp")
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_file, cache_file)
+    except (OSError, TypeError, ValueError) as e:
+        if not _cache_write_warned:
+            _cache_write_warned = True
+            log.warning(f"Could not write config cache {cache_file}: {e}")
 
 
 @dataclass
@@ -34,6 +99,19 @@ class UserConfig:
     schedule: ScheduleConfig = field(default_factory=ScheduleConfig)
     warnings: list[int] = field(default_factory=lambda: [10, 5, 1])  # Minutes before limit to warn
 
+    def __post_init__(self) -> None:
+        # Thresholds are minutes remaining in a day; drop anything else
+        valid = [
+            w for w in self.warnings
+            if isinstance(w, int) and not isinstance(w, bool) and 0 < w <= MAX_WARNING_MINUTES
+        ]
+        if len(valid) != len(self.warnings):
+            log.warning(
+                f"Ignoring invalid warning thresholds for {self.username}: "
+                f"{[w for w in self.warnings if w not in valid]} (must be 1-{MAX_WARNING_MINUTES})"
+            )
+            self.warnings = valid
+
 
 @dataclass
 class ActivityConfig:
@@ -50,6 +128,14 @@ class Config:
     device: DeviceConfig = field(default_factory=DeviceConfig)
     users: list[UserConfig] = field(default_factory=list)
     activity: ActivityConfig = field(default_factory=ActivityConfig)
+    _user_index: dict[str, UserConfig] = field(init=False, default_factory=dict, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._index_users()
+
+    def _index_users(self) -> None:
+        """Rebuild the username -> UserConfig lookup table."""
+        self._user_index = {user.username: user for user in self.users}
 
     @classmethod
     def load(cls, path: Path) -> "Config":
@@ -57,72 +143,59 @@ class Config:
         if not path.exists():
             raise FileNotFoundError(f"Config file not found: {path}")
 
-        with open(path) as f:
-            data = yaml.safe_load(f) or {}
+        with open(path, "rb") as f:
+            data = _load_yaml(f) or {}
 
-        config = cls()
+        return cls.from_dict(data)
 
-        # MQTT config
-        if "mqtt" in data:
-            mqtt_data = data["mqtt"]
-            config.mqtt = MqttConfig(
-                broker=mqtt_data.get("broker", config.mqtt.broker),
-                port=mqtt_data.get("port", config.mqtt.port),
-                username=mqtt_data.get("username"),
-                password=mqtt_data.get("password"),
-            )
-
-        # Device config
-        if "device" in data:
-            device_data = data["device"]
-            config.device = DeviceConfig(
-                hostname=device_data.get("hostname", socket.gethostname())
-            )
+    @classmethod
+    def load_cached(cls, path: Path, cache_file: Path = CONFIG_CACHE_FILE) -> "Config":
+        """Load configuration, reusing a JSON copy of the parsed YAML.
+
+        The cache is keyed on the config file's path, mtime and size, so YAML
+        is only parsed again after the file changes. Cache errors are not
+        fatal; the file is then simply parsed.
+        """
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Config file not found: {path}") from None
+        key = [str(path.resolve()), st.st_mtime_ns, st.st_size]
+
+        try:
+            cached = fastjson.loads(cache_file.read_bytes())
+            if cached["key"] == key:
+                return cls.from_dict(cached["data"])
+        except (OSError, ValueError, LookupError, TypeError):
+            pass
+
+        with open(path, "rb") as f:
+            data = _load_yaml(f) or {}
+
+        _write_cache(cache_file, {"key": key, "data": data})
+        return cls.from_dict(data)
 
-        # Users config
-        if "users" in data:
-            for user_data in data["users"]:
-                schedule_data = user_data.get("schedule", {})
-                user = UserConfig(
+    @classmethod
+    def from_dict(cls, data: dict) -> "Config":
+        """Build configuration from a parsed config mapping."""
+        return cls(
+            mqtt=_from_dict(MqttConfig, data.get("mqtt")),
+            device=_from_dict(DeviceConfig, data.get("device")),
+            users=[
+                _from_dict(
+                    UserConfig,
+                    user_data,
                     username=user_data["username"],
-                    daily_minutes=user_data.get("daily_minutes", 0),
-                    schedule=ScheduleConfig(
-                        weekday=schedule_data.get("weekday", "00:00-23:59"),
-                        weekend=schedule_data.get("weekend", "00:00-23:59"),
-                    ),
-                    warnings=user_data.get("warnings", [10, 5, 1]),
+                    schedule=_from_dict(ScheduleConfig, user_data.get("schedule")),
                 )
-                config.users.append(user)
-
-        # Activity config
-        if "activity" in data:
-            activity_data = data["activity"]
-            config.activity = ActivityConfig(
-                poll_interval=activity_data.get(
-                    "poll_interval", config.activity.poll_interval
-                ),
-                pause_auto_resume=activity_data.get(
-                    "pause_auto_resume", config.activity.pause_auto_resume
-                ),
-                tamper_detection=activity_data.get(
-                    "tamper_detection", config.activity.tamper_detection
-                ),
-                idle_threshold_minutes=activity_data.get(
-                    "idle_threshold_minutes", config.activity.idle_threshold_minutes
-                ),
-                track_apps=activity_data.get(
-                    "track_apps", config.activity.track_apps
-                ),
-            )
-
-        return config
+                for user_data in data.get("users") or []
+            ],
+            activity=_from_dict(ActivityConfig, data.get("activity")),
+        )
 
     def get_user(self, username: str) -> UserConfig | None:
         """Get config for a specific user."""
-        for user in self.users:
-            if user.username == username:
-                return user
-        return None
+        return self._user_index.get(username)
 
     @property
     def topic_prefix(self) -> str:
@@ -1,7 +1,9 @@
 """DNS-based website blocking using dnsmasq for Kidlock agent."""
 
 import logging
+import os
 import subprocess
+import threading
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +22,30 @@ DEFAULT_WHITELIST = [
 DNSMASQ_CONFIG_PATH = "/etc/NetworkManager/dnsmasq.d/kidlock.conf"
 UPSTREAM_DNS = "8.8.8.8"
 
+# Delay before applying changes, so bursts of settings updates are coalesced
+APPLY_DELAY_SECONDS = 0.5
+
+CONFIG_HEADER = """\
+# Kidlock DNS blocking configuration
+# Auto-generated - do not edit manually
+
+# Block all domains by default (return NXDOMAIN)
+address=/#/
+
+# Whitelisted domains - forward to upstream DNS"""
+
+DISABLED_CONFIG = "# Kidlock DNS blocking disabled\n"
+
+# Commands that make NetworkManager restart its dnsmasq instance, tried in
+# order. dnsmasq itself only re-reads hosts files on SIGHUP, so "dns-full"
+# (NM >= 1.22) is the lightest reload that picks up server=/address= changes;
+# restarting NetworkManager is the fallback for older versions. Without root
+# each runs via sudo, so they are fixed argv lists a sudoers rule can name.
+RELOAD_DNS_COMMANDS = (
+    ["/usr/bin/nmcli", "general", "reload", "dns-full"],
+    ["/bin/systemctl", "restart", "NetworkManager"],
+)
+
 
 class DnsBlocker:
     """Manages DNS-based website whitelisting via dnsmasq.
@@ -31,6 +57,16 @@ class DnsBlocker:
     def __init__(self, enabled: bool = False, whitelist: list[str] | None = None):
         self._enabled = enabled
         self._whitelist = whitelist or []
+        # Raw domain list from the last update_whitelist() call
+        self._whitelist_source: tuple[str, ...] = tuple(self._whitelist)
+        # Sorted whitelist plus defaults, rebuilt when the whitelist changes
+        self._effective_whitelist: list[str] | None = None
+        # As root the config file can be written directly instead of via sudo
+        self._is_root = os.geteuid() == 0
+        # Debounced application of the current state to dnsmasq
+        self._apply_timer: threading.Timer | None = None
+        self._timer_lock = threading.Lock()
+        self._apply_lock = threading.Lock()
         log.info(f"DnsBlocker initialized: enabled={enabled}, whitelist={self._whitelist}")
 
     @property
@@ -55,12 +91,7 @@ class DnsBlocker:
         self._enabled = enabled
         log.info(f"DNS blocking {'enabled' if enabled else 'disabled'}")
 
-        if enabled:
-            self._write_config()
-            self._restart_dnsmasq()
-        else:
-            self._clear_config()
-            self._restart_dnsmasq()
+        self._schedule_apply()
 
     def update_whitelist(self, domains: list[str]) -> None:
         """Update the whitelist of allowed domains.
@@ -68,6 +99,12 @@ class DnsBlocker:
         Args:
             domains: List of domain names to allow (e.g., ["google.com", "youtube.com"]).
         """
+        # Most settings messages repeat the previous list verbatim
+        source = tuple(domains)
+        if source == self._whitelist_source:
+            return
+        self._whitelist_source = source
+
         # Normalize domains (strip whitespace, lowercase)
         normalized = [d.strip().lower() for d in domains if d.strip()]
 
@@ -75,93 +112,101 @@ class DnsBlocker:
             return
 
         self._whitelist = normalized
+        self._effective_whitelist = None
         log.info(f"Whitelist updated: {self._whitelist}")
 
         if self._enabled:
-            self._write_config()
-            self._restart_dnsmasq()
+            self._schedule_apply()
+
+    def flush(self) -> None:
+        """Apply any pending change immediately (e.g. before shutdown)."""
+        with self._timer_lock:
+            if self._apply_timer is None:
+                return
+            self._apply_timer.cancel()
+        self._apply_pending()
+
+    def _schedule_apply(self) -> None:
+        """(Re)arm the timer that applies the current state to dnsmasq."""
+        with self._timer_lock:
+            if self._apply_timer:
+                self._apply_timer.cancel()
+            self._apply_timer = threading.Timer(APPLY_DELAY_SECONDS, self._apply_pending)
+            self._apply_timer.daemon = True
+            self._apply_timer.start()
+
+    def _apply_pending(self) -> None:
+        """Apply the latest enabled/whitelist state."""
+        with self._apply_lock:
+            with self._timer_lock:
+                self._apply_timer = None
+            if self._enabled:
+                self._apply_config(self._generate_config())
+            else:
+                self._apply_config(DISABLED_CONFIG)
 
     def _get_effective_whitelist(self) -> list[str]:
         """Get whitelist including default entries."""
-        combined = set(DEFAULT_WHITELIST)
-        combined.update(self._whitelist)
-        return sorted(combined)
+        if self._effective_whitelist is None:
+            combined = set(DEFAULT_WHITELIST)
+            combined.update(self._whitelist)
+            self._effective_whitelist = sorted(combined)
+        return self._effective_whitelist
 
     def _generate_config(self) -> str:
         """Generate dnsmasq configuration content."""
-        lines = [
-            "# Kidlock DNS blocking configuration",
-            "# Auto-generated - do not edit manually",
-            "",
-            "# Block all domains by default (return NXDOMAIN)",
-            "address=/#/",
-            "",
-            "# Whitelisted domains - forward to upstream DNS",
-        ]
-
-        for domain in self._get_effective_whitelist():
-            # Allow the domain and all subdomains
-            lines.append(f"server=/{domain}/{UPSTREAM_DNS}")
-            lines.append(f"server=/.{domain}/{UPSTREAM_DNS}")
-
-        lines.append("")
-        return "\n".join(lines)
-
-    def _write_config(self) -> None:
-        """Write dnsmasq configuration file via sudo."""
-        config_content = self._generate_config()
-        log.debug(f"Writing dnsmasq config:\n{config_content}")
-
-        try:
-            # Use sudo tee to write the config file
-            proc = subprocess.run(
-                ["sudo", "/usr/bin/tee", DNSMASQ_CONFIG_PATH],
-                input=config_content.encode(),
-                capture_output=True,
-                timeout=10,
-            )
-            if proc.returncode != 0:
-                log.error(f"Failed to write dnsmasq config: {proc.stderr.decode()}")
-            else:
-                log.info(f"Wrote dnsmasq config to {DNSMASQ_CONFIG_PATH}")
-        except subprocess.TimeoutExpired:
-            log.error("Timeout writing dnsmasq config")
-        except Exception as e:
-            log.error(f"Error writing dnsmasq config: {e}")
-
-    def _clear_config(self) -> None:
-        """Clear the dnsmasq configuration (disable blocking)."""
-        config_content = "# Kidlock DNS blocking disabled\n"
-
-        try:
-            proc = subprocess.run(
-                ["sudo", "/usr/bin/tee", DNSMASQ_CONFIG_PATH],
-                input=config_content.encode(),
-                capture_output=True,
-                timeout=10,
-            )
-            if proc.returncode != 0:
-                log.error(f"Failed to clear dnsmasq config: {proc.stderr.decode()}")
-            else:
-                log.info("Cleared dnsmasq config (blocking disabled)")
-        except subprocess.TimeoutExpired:
-            log.error("Timeout clearing dnsmasq config")
-        except Exception as e:
-            log.error(f"Error clearing dnsmasq config: {e}")
+        # Allow each domain and all of its subdomains
+        body = "\n".join(
+            f"server=/{domain}/{UPSTREAM_DNS}\nserver=/.{domain}/{UPSTREAM_DNS}"
+            for domain in self._get_effective_whitelist()
+        )
+        return f"{CONFIG_HEADER}\n{body}\n"
+
+    def _write_config_file(self, config_content: str) -> None:
+        """Atomically replace the dnsmasq config file (requires root).
+
+        The temporary file is a dotfile so dnsmasq's conf-dir scan never
+        picks up a half-written config.
+        """
+        config_dir, name = os.path.split(DNSMASQ_CONFIG_PATH)
+        tmp_path = os.path.join(config_dir, f".{name}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(config_content.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, DNSMASQ_CONFIG_PATH)
+
+    def _apply_config(self, config_content: str) -> None:
+        """Write dnsmasq configuration and reload it."""
+        log.debug(f"Applying dnsmasq config:\n{config_content}")
 
-    def _restart_dnsmasq(self) -> None:
-        """Restart NetworkManager to reload dnsmasq config."""
         try:
-            proc = subprocess.run(
-                ["sudo", "/bin/systemctl", "restart", "NetworkManager"],
-                capture_output=True,
-                timeout=30,
-            )
-            if proc.returncode != 0:
-                log.error(f"Failed to restart NetworkManager: {proc.stderr.decode()}")
+            if self._is_root:
+                self._write_config_file(config_content)
             else:
-                log.info("Restarted NetworkManager (dnsmasq reloaded)")
+                proc = subprocess.run(
+                    ["sudo", "/usr/bin/tee", DNSMASQ_CONFIG_PATH],
+                    input=config_content.encode(),
+                    capture_output=True,
+                    timeout=10,
+                )
+                if proc.returncode != 0:
+                    log.error(f"Failed to write dnsmasq config: {proc.stderr.decode()}")
+                    return
+            log.info(f"Wrote dnsmasq config to {DNSMASQ_CONFIG_PATH}")
+            self._reload_dns()
         except subprocess.TimeoutExpired:
-            log.error("Timeout restarting NetworkManager")
+            log.error("Timeout applying dnsmasq config")
         except Exception as e:
-            log.error(f"Error restarting NetworkManager: {e}")
+            log.error(f"Error applying dnsmasq config: {e}")
+
+    def _reload_dns(self) -> None:
+        """Reload NetworkManager's dnsmasq, falling back to a restart."""
+        prefix = [] if self._is_root else ["sudo"]
+        for cmd in RELOAD_DNS_COMMANDS:
+            proc = subprocess.run([*prefix, *cmd], capture_output=True, timeout=30)
+            if proc.returncode == 0:
+                log.info(f"Reloaded dnsmasq ({' '.join(cmd)})")
+                return
+        log.error(f"Failed to reload dnsmasq: {proc.stderr.decode()}")
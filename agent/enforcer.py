@@ -2,13 +2,20 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import os
+import secrets
+import shutil
+import struct
 import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
+from functools import cache
 from pathlib import Path
 
+from . import fastjson
 from .config import ScheduleConfig, UserConfig
 
 log = logging.getLogger(__name__)
@@ -16,26 +23,73 @@ log = logging.getLogger(__name__)
 STATE_DIR = Path("/var/lib/kidlock")
 STATE_FILE = STATE_DIR / "state.json"
 PAM_CHECK_SCRIPT = Path("/usr/local/bin/kidlock-pam-check")
+UTMP_PATH = Path("/var/run/utmp")
 
+# glibc struct utmp on Linux: type, pid, line, id, user, host, exit status,
+# session, tv_sec, tv_usec, addr_v6, reserved (384 bytes)
+UTMP_RECORD = struct.Struct("hi32s4s32s256shhiii4i20s")
+UTMP_USER_PROCESS = 7
 
+# Minimum seconds between routine state writes (see Enforcer._mark_dirty)
+SAVE_INTERVAL = 5.0
+
+# How long a logged-in user lookup is reused before querying again, in seconds
+LOGGED_IN_CACHE_SECONDS = 1.0
+
+
+@cache
+def _which(command: str) -> str:
+    """Resolve a command to its absolute path (or leave it as-is)."""
+    return shutil.which(command) or command
+
+
+def _parse_hhmm(value: str) -> int:
+    """Convert "HH:MM" to minutes since midnight.
+
+    Raises ValueError if the value is not a valid time of day.
+    """
+    hour, minute = value.split(":")
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"time out of range: {value.strip()}")
+    return hour * 60 + minute
+
+
+def _run_for_status(args: list[str], timeout: float) -> int:
+    """Run a command and return its exit code, discarding output.
+
+    Passing an absolute path with close_fds=False and no pipes lets
+    subprocess use posix_spawn instead of fork+exec. Nothing leaks, as the
+    agent's own descriptors are non-inheritable by default.
+    """
+    return subprocess.run(
+        [_which(args[0]), *args[1:]],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=False,
+        timeout=timeout,
+    ).returncode
+
+
+@dataclass(slots=True)
 class UserState:
     """Tracks state for a single user."""
 
-    def __init__(self, username: str):
-        self.username = username
-        self.usage_minutes: int = 0
-        self.last_usage_date: str | None = None
-        self.blocked: bool = False
-        self.block_reason: str = ""
-        # New fields for enhanced features
-        self.paused: bool = False
-        self.paused_at: str | None = None  # ISO timestamp when paused
-        self.bonus_minutes: int = 0  # Extra time for today
-        self.warnings_sent: set[int] = set()  # Warning thresholds already sent today
-        # Idle detection (not persisted - runtime only)
-        self.is_idle: bool = False
-        # Time request (persisted)
-        self.pending_request: dict | None = None  # {id, minutes, reason, created_at}
+    username: str
+    usage_minutes: int = 0
+    last_usage_date: str | None = None
+    blocked: bool = False
+    block_reason: str = ""
+    # New fields for enhanced features
+    paused: bool = False
+    paused_at: str | None = None  # ISO timestamp when paused
+    bonus_minutes: int = 0  # Extra time for today
+    warnings_sent: set[int] = field(default_factory=set)  # Warning thresholds already sent today
+    # Idle detection (not persisted - runtime only)
+    is_idle: bool = False
+    # Time request (persisted)
+    pending_request: dict | None = None  # {id, minutes, reason, created_at}
 
     def to_dict(self) -> dict:
         return {
@@ -46,7 +100,7 @@ class UserState:
             "paused": self.paused,
             "paused_at": self.paused_at,
             "bonus_minutes": self.bonus_minutes,
-            "warnings_sent": list(self.warnings_sent),
+            "warnings_sent": sorted(self.warnings_sent),
             "pending_request": self.pending_request,
         }
 
@@ -70,45 +124,178 @@ class Enforcer:
 
     def __init__(self):
         self._user_states: dict[str, UserState] = {}
+        # Serializes saves (main loop and MQTT callback thread) and guards
+        # _user_states against inserts while a save is encoding it
+        self._save_lock = threading.Lock()
+        # Unsaved changes and when state was last written (monotonic)
+        self._dirty = False
+        self._last_save = 0.0
+        # (payload, st_mtime_ns, st_size) of the last successful write, to skip
+        # rewriting identical state while the file is still the one we wrote
+        self._last_written: tuple[bytes, int, int] | None = None
+        # Parsed "HH:MM-HH:MM" schedule strings, as (start, end) minutes
+        self._schedule_cache: dict[str, tuple[int, int]] = {}
+        # (monotonic timestamp, users) of the last logged-in user lookup
+        self._logged_in_cache: tuple[float, set[str]] | None = None
+        # (mtime_ns, users) of the last utmp parse
+        self._utmp_cache: tuple[int, set[str]] | None = None
+        # Today's ISO date and the epoch time at which it stops being today
+        self._today_str = ""
+        self._today_expires = 0.0
         self._load_state()
 
     def _load_state(self) -> None:
         """Load persisted state from disk."""
         if STATE_FILE.exists():
             try:
-                with open(STATE_FILE) as f:
-                    data = json.load(f)
+                with open(STATE_FILE, "rb") as f:
+                    data = fastjson.loads(f.read())
                 for username, user_data in data.get("users", {}).items():
                     self._user_states[username] = UserState.from_dict(username, user_data)
                 log.info(f"Loaded state for {len(self._user_states)} users")
             except Exception as e:
                 log.error(f"Failed to load state: {e}")
 
+    def _mark_dirty(self, force: bool = False) -> None:
+        """Record a state change and persist it if a save is due.
+
+        Routine updates are coalesced to at most one write per SAVE_INTERVAL;
+        the agent calls flush() once per loop to write the remainder. Changes
+        the PAM check depends on (blocking) pass force=True.
+        """
+        self._dirty = True
+        if force or time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write pending state changes to disk."""
+        if self._dirty:
+            self._save_state()
+
     def _save_state(self) -> None:
         """Persist state to disk."""
+        with self._save_lock:
+            self._write_state()
+
+    def _write_state(self) -> None:
+        """Encode and atomically write state; caller holds _save_lock."""
+        self._dirty = False
+        self._last_save = time.monotonic()
         STATE_DIR.mkdir(parents=True, exist_ok=True)
-        data = {
-            "users": {
-                username: state.to_dict()
-                for username, state in self._user_states.items()
-            }
-        }
+        # UserState.to_dict is applied by the encoder, so no copy of the
+        # user map is built per save
+        data = {"users": self._user_states}
+        # Write a temp file and rename it over the state file so the PAM check
+        # never reads a partially written file (which it would treat as allow)
+        tmp_file = STATE_FILE.with_suffix(".json.tmp")
         try:
-            with open(STATE_FILE, "w") as f:
-                json.dump(data, f, indent=2)
+            payload = fastjson.dumps(
+                data,
+                pretty=log.isEnabledFor(logging.DEBUG),
+                default=UserState.to_dict,
+            )
+            if self._is_last_written(payload):
+                # Changes cancelled out; spare the (often SD card) disk a write
+                return
+            with open(tmp_file, "wb") as f:
+                f.write(payload)
             # Make readable by all users (for tray indicator)
-            os.chmod(STATE_FILE, 0o644)
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, STATE_FILE)
+            st = os.stat(STATE_FILE)
+            self._last_written = (payload, st.st_mtime_ns, st.st_size)
         except Exception as e:
             log.error(f"Failed to save state: {e}")
 
+    def _is_last_written(self, payload: bytes) -> bool:
+        """Check whether STATE_FILE still holds exactly this payload from our last write.
+
+        The agent also rewrites the file in place (schedule overrides), and it
+        may be deleted, so the payload alone is not enough.
+        """
+        if self._last_written is None or self._last_written[0] != payload:
+            return False
+        try:
+            st = os.stat(STATE_FILE)
+        except OSError:
+            return False
+        return self._last_written[1:] == (st.st_mtime_ns, st.st_size)
+
     def get_user_state(self, username: str) -> UserState:
         """Get or create state for a user."""
-        if username not in self._user_states:
-            self._user_states[username] = UserState(username)
-        return self._user_states[username]
+        state = self._user_states.get(username)
+        if state is None:
+            with self._save_lock:
+                state = self._user_states.setdefault(username, UserState(username))
+        return state
+
+    def _today(self) -> str:
+        """Get today's local date as an ISO string, recomputed at midnight."""
+        now = time.time()
+        if now >= self._today_expires:
+            today = date.today()
+            self._today_str = today.isoformat()
+            # mktime normalizes day overflow and resolves DST for the next midnight
+            self._today_expires = time.mktime(
+                (today.year, today.month, today.day + 1, 0, 0, 0, 0, 0, -1)
+            )
+        return self._today_str
 
     def get_logged_in_users(self) -> set[str]:
-        """Get set of currently logged-in users."""
+        """Get set of currently logged-in users.
+
+        The result is cached for LOGGED_IN_CACHE_SECONDS so a single agent
+        tick looks sessions up once, however many users it checks. The
+        returned set may be shared with later calls and must not be mutated.
+        """
+        now = time.monotonic()
+        if self._logged_in_cache is not None:
+            cached_at, users = self._logged_in_cache
+            if now - cached_at < LOGGED_IN_CACHE_SECONDS:
+                return users
+
+        users = self._query_logged_in_users()
+        self._logged_in_cache = (now, users)
+        return users
+
+    def _query_logged_in_users(self) -> set[str]:
+        """Read logged-in users from utmp, falling back to `who`."""
+        try:
+            return self._read_utmp_users()
+        except (OSError, ValueError, struct.error) as e:
+            log.debug(f"Cannot parse {UTMP_PATH} ({e}), falling back to who")
+            return self._run_who()
+
+    def _read_utmp_users(self) -> set[str]:
+        """Parse user names of login sessions directly from utmp.
+
+        This is what `who` does, without the fork and exec. The file is only
+        re-read when its mtime changes.
+
+        Raises:
+            OSError: If utmp cannot be read.
+            ValueError: If the file does not match the expected record layout.
+        """
+        mtime_ns = UTMP_PATH.stat().st_mtime_ns
+        if self._utmp_cache is not None and self._utmp_cache[0] == mtime_ns:
+            return self._utmp_cache[1]
+
+        data = UTMP_PATH.read_bytes()
+        if len(data) % UTMP_RECORD.size:
+            raise ValueError(f"size {len(data)} is not a multiple of {UTMP_RECORD.size}")
+
+        users = set()
+        for record in UTMP_RECORD.iter_unpack(data):
+            if record[0] == UTMP_USER_PROCESS:
+                user = record[4].split(b"\0", 1)[0]
+                if user:
+                    users.add(user.decode(errors="replace"))
+
+        self._utmp_cache = (mtime_ns, users)
+        return users
+
+    def _run_who(self) -> set[str]:
+        """Run `who` and return the set of logged-in users."""
         try:
             result = subprocess.run(
                 ["who"],
@@ -126,7 +313,11 @@ class Enforcer:
             return set()
 
     def is_within_schedule(self, schedule: ScheduleConfig) -> bool:
-        """Check if current time is within allowed schedule."""
+        """Check if current time is within allowed schedule.
+
+        The end minute is inclusive, and a window whose end is before its
+        start (e.g. "22:00-06:00") wraps around midnight.
+        """
         now = datetime.now()
         weekday = now.weekday()  # 0=Monday, 6=Sunday
 
@@ -134,23 +325,35 @@ class Enforcer:
         schedule_str = schedule.weekend if weekday >= 5 else schedule.weekday
 
         try:
-            start_str, end_str = schedule_str.split("-")
-            start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
-            end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
-            current_time = now.time()
-
-            return start_time <= current_time <= end_time
+            start, end = self._parse_schedule(schedule_str)
         except ValueError as e:
             log.error(f"Invalid schedule format '{schedule_str}': {e}")
             return True  # Allow on error
 
+        current = now.hour * 60 + now.minute
+        if start <= end:
+            return start <= current <= end
+        return current >= start or current <= end
+
+    def _parse_schedule(self, schedule_str: str) -> tuple[int, int]:
+        """Parse an "HH:MM-HH:MM" schedule into minutes since midnight, with caching.
+
+        Raises ValueError if the string is malformed.
+        """
+        parsed = self._schedule_cache.get(schedule_str)
+        if parsed is None:
+            start_str, end_str = schedule_str.split("-")
+            parsed = (_parse_hhmm(start_str), _parse_hhmm(end_str))
+            self._schedule_cache[schedule_str] = parsed
+        return parsed
+
     def check_user(self, user_config: UserConfig) -> tuple[bool, str]:
         """Check if user should be allowed.
 
         Returns (allowed, reason).
         """
         state = self.get_user_state(user_config.username)
-        today = date.today().isoformat()
+        today = self._today()
 
         # Reset usage and bonus if new day
         if state.last_usage_date != today:
@@ -158,7 +361,7 @@ class Enforcer:
             state.bonus_minutes = 0
             state.warnings_sent = set()
             state.last_usage_date = today
-            self._save_state()
+            self._mark_dirty()
 
         # Check schedule
         if not self.is_within_schedule(user_config.schedule):
@@ -175,20 +378,20 @@ class Enforcer:
     def add_usage(self, username: str, minutes: int) -> None:
         """Add usage time for a user."""
         state = self.get_user_state(username)
-        today = date.today().isoformat()
+        today = self._today()
 
         if state.last_usage_date != today:
             state.usage_minutes = 0
             state.last_usage_date = today
 
         state.usage_minutes += minutes
-        self._save_state()
+        self._mark_dirty()
         log.debug(f"User {username} usage: {state.usage_minutes} minutes")
 
     def get_usage_minutes(self, username: str) -> int:
         """Get today's usage minutes for a user."""
         state = self.get_user_state(username)
-        today = date.today().isoformat()
+        today = self._today()
 
         if state.last_usage_date != today:
             return 0
@@ -200,26 +403,18 @@ class Enforcer:
         state = self.get_user_state(username)
         state.blocked = True
         state.block_reason = reason
-        self._save_state()
+        self._mark_dirty(force=True)
+        # Sessions are about to change; don't serve a stale user list
+        self._logged_in_cache = None
 
         try:
             # Try loginctl first (cleanest method)
-            result = subprocess.run(
-                ["loginctl", "terminate-user", username],
-                capture_output=True,
-                timeout=10,
-            )
-            if result.returncode == 0:
+            if _run_for_status(["loginctl", "terminate-user", username], timeout=10) == 0:
                 log.info(f"Terminated sessions for {username} via loginctl")
                 return True
 
             # Fallback: kill all user processes
-            result = subprocess.run(
-                ["pkill", "-KILL", "-u", username],
-                capture_output=True,
-                timeout=10,
-            )
-            if result.returncode == 0:
+            if _run_for_status(["pkill", "-KILL", "-u", username], timeout=10) == 0:
                 log.info(f"Killed processes for {username} via pkill")
                 return True
 
@@ -233,9 +428,11 @@ class Enforcer:
     def unblock_user(self, username: str) -> None:
         """Unblock a user (allow login again)."""
         state = self.get_user_state(username)
+        if not state.blocked and not state.block_reason:
+            return  # Called every poll for allowed users; nothing to do
         state.blocked = False
         state.block_reason = ""
-        self._save_state()
+        self._mark_dirty(force=True)
         log.info(f"Unblocked user {username}")
 
     def set_paused(self, username: str, paused: bool) -> None:
@@ -249,7 +446,7 @@ class Enforcer:
             state.paused = False
             state.paused_at = None
             log.info(f"Resumed timer for {username}")
-        self._save_state()
+        self._mark_dirty()
 
     def is_paused(self, username: str) -> bool:
         """Check if timer is paused for a user."""
@@ -282,7 +479,7 @@ class Enforcer:
         if state.blocked and "limit" in state.block_reason.lower():
             state.blocked = False
             state.block_reason = ""
-        self._save_state()
+        self._mark_dirty(force=True)
         log.info(f"Added {minutes} bonus minutes for {username} (total bonus: {state.bonus_minutes})")
 
     def get_time_remaining(self, username: str, daily_limit: int) -> int:
@@ -294,7 +491,7 @@ class Enforcer:
             return -1
 
         state = self.get_user_state(username)
-        today = date.today().isoformat()
+        today = self._today()
 
         if state.last_usage_date != today:
             return daily_limit  # Full time if new day
@@ -325,7 +522,7 @@ class Enforcer:
         """Mark a warning threshold as sent."""
         state = self.get_user_state(username)
         state.warnings_sent.add(threshold)
-        self._save_state()
+        self._mark_dirty()
 
     def get_status(self, username: str, daily_limit: int) -> str:
         """Get current status string for a user."""
@@ -360,16 +557,15 @@ class Enforcer:
 
         Returns the created request dict.
         """
-        import uuid
         state = self.get_user_state(username)
         request = {
-            "id": str(uuid.uuid4())[:8],
+            "id": secrets.token_hex(4),
             "minutes": minutes,
             "reason": reason,
             "created_at": datetime.now().isoformat(),
         }
         state.pending_request = request
-        self._save_state()
+        self._mark_dirty()
         log.info(f"Created time request for {username}: {minutes} minutes")
         return request
 
@@ -388,9 +584,8 @@ class Enforcer:
             return None
 
         minutes = state.pending_request.get("minutes", 15)
-        self.add_bonus_time(username, minutes)
         state.pending_request = None
-        self._save_state()
+        self.add_bonus_time(username, minutes)  # Saves the cleared request too
         log.info(f"Approved time request for {username}: {minutes} minutes")
         return minutes
 
@@ -404,7 +599,7 @@ class Enforcer:
             return False
 
         state.pending_request = None
-        self._save_state()
+        self._mark_dirty()
         log.info(f"Denied time request for {username}")
         return True
 
@@ -419,12 +614,9 @@ def check_login_allowed(username: str) -> tuple[bool, str]:
 
     This reads the state file directly without needing the full agent.
     """
-    if not STATE_FILE.exists():
-        return True, ""  # Allow if no state
-
     try:
-        with open(STATE_FILE) as f:
-            data = json.load(f)
+        with open(STATE_FILE, "rb") as f:
+            data = fastjson.loads(f.read())
 
         user_data = data.get("users", {}).get(username, {})
         if user_data.get("blocked", False):
@@ -433,6 +625,8 @@ def check_login_allowed(username: str) -> tuple[bool, str]:
 
         return True, ""
 
+    except FileNotFoundError:
+        return True, ""  # Allow if no state
     except Exception as e:
         log.error(f"PAM check failed: {e}")
         return True, ""  # Allow on error
@@ -0,0 +1,42 @@
+"""JSON encoding helpers for Kidlock agent.
+
+Uses orjson when it is installed (``pip install kidlock[fast]``) and falls
+back to the standard library otherwise. Both paths produce compact UTF-8
+encoded bytes, which can be written to files or passed to paho directly.
+"""
+
+import json
+from collections.abc import Callable
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+# orjson.JSONDecodeError subclasses this, so callers only need to catch one
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj, pretty: bool = False, default: Callable[[Any], Any] | None = None) -> bytes:
+    """Serialize obj to JSON bytes (indented with 2 spaces if pretty).
+
+    default is called for objects that are not natively serializable and must
+    return something that is. Dataclass instances are always passed to it, so
+    both backends produce the same output.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATACLASS
+        return orjson.dumps(obj, default=default, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, default=default).encode()
+    return json.dumps(obj, separators=(",", ":"), default=default).encode()
+
+
+def loads(data: bytes | str):
+    """Deserialize JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -6,11 +6,18 @@ import logging
 import os
 import re
 import signal
+import stat
 import subprocess
 import sys
+import threading
 import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TypeVar
 
+from . import fastjson
 from .app_tracker import AppTracker
 from .config import Config
 from .dns_blocker import DnsBlocker
@@ -23,6 +30,16 @@ from .tamper_detector import TamperDetector
 # Directory for file-based time requests from tray
 REQUEST_DIR = Path("/var/lib/kidlock/requests")
 
+# Request files are a few dozen bytes; anything larger is discarded unread
+MAX_REQUEST_BYTES = 4096
+
+# An empty request file older than this (seconds) is abandoned and removed
+EMPTY_REQUEST_GRACE_SECONDS = 5.0
+
+# A claimed (*.taken) request file older than this (seconds) was left by an
+# agent that died while processing it, and is removed
+STALE_CLAIM_SECONDS = 60.0
+
 # State file for persistent data (shared with enforcer)
 STATE_DIR = Path("/var/lib/kidlock")
 STATE_FILE = STATE_DIR / "state.json"
@@ -30,6 +47,11 @@ STATE_FILE = STATE_DIR / "state.json"
 # Regex for schedule validation (HH:MM-HH:MM)
 SCHEDULE_RE = re.compile(r"^([01]\d|2[0-3]):[0-5]\d-([01]\d|2[0-3]):[0-5]\d$")
 
+# Maximum per-user platform queries (each spawns subprocesses) run at once
+PLATFORM_QUERY_WORKERS = 4
+
+T = TypeVar("T")
+
 log = logging.getLogger(__name__)
 
 # Default config paths
@@ -42,7 +64,9 @@ class KidlockAgent:
 
     def __init__(self, config: Config):
         self.config = config
-        self._running = False
+        # Set by request_stop() to end and wake the main loop; never cleared,
+        # so a stop requested during startup is not lost
+        self._stop_event = threading.Event()
 
         # Initialize components
         self.enforcer = Enforcer()
@@ -52,16 +76,25 @@ class KidlockAgent:
         self.tamper_detector = TamperDetector()
         self.platform = LinuxPlatform()
         self.app_tracker = AppTracker()
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=PLATFORM_QUERY_WORKERS,
+            thread_name_prefix="kidlock-query",
+        )
 
-        # Track last check time for usage accounting
-        self._last_check = time.time()
+        # Track last check time (monotonic) and unbilled seconds per user
+        # for usage accounting
+        self._last_check = time.monotonic()
+        self._usage_seconds: defaultdict[str, float] = defaultdict(float)
 
         # Track user login states for event detection
-        self._last_logged_in: set = set()
+        self._last_logged_in: set[str] = set()
 
         # Track tamper detection state
         self._tamper_detected = False
 
+        # REQUEST_DIR mtime at the last scan that left it empty
+        self._request_dir_mtime: int | None = None
+
     def _load_schedule_overrides(self) -> None:
         """Load schedule overrides from state.json and apply to config."""
         if not STATE_FILE.exists():
@@ -112,6 +145,12 @@ class KidlockAgent:
         except Exception as e:
             log.error(f"Failed to save schedule overrides: {e}")
 
+    def _command_targets(self, username: str | None) -> list[str]:
+        """Return the users a command applies to: the named one, else all."""
+        if username:
+            return [username]
+        return [user.username for user in self.config.users]
+
     def _on_command(self, command: dict) -> None:
         """Handle incoming MQTT command."""
         action = command.get("action", "").lower()
@@ -119,58 +158,30 @@ class KidlockAgent:
 
         if action == "lock":
             # Force logout specified user or all controlled users
-            if username:
-                user_config = self.config.get_user(username)
-                if user_config:
-                    self.enforcer.force_logout(username, "Remote lock command")
-            else:
-                for user in self.config.users:
-                    self.enforcer.force_logout(user.username, "Remote lock command")
+            for target in self._command_targets(username):
+                if self.config.get_user(target):
+                    self.enforcer.force_logout(target, "Remote lock command")
 
         elif action == "unlock":
             # Unblock specified user or all controlled users
-            if username:
-                self.enforcer.unblock_user(username)
-            else:
-                for user in self.config.users:
-                    self.enforcer.unblock_user(user.username)
+            for target in self._command_targets(username):
+                self.enforcer.unblock_user(target)
 
-        elif action == "pause":
-            # Pause timer for specified user
-            if username:
-                self.enforcer.set_paused(username, True)
-                self.notifier.send_paused_notification(username, True)
-                self.mqtt_client.publish_event("pause_changed", username, {"paused": True})
-            else:
-                for user in self.config.users:
-                    self.enforcer.set_paused(user.username, True)
-                    self.notifier.send_paused_notification(user.username, True)
-                    self.mqtt_client.publish_event("pause_changed", user.username, {"paused": True})
-
-        elif action == "resume":
-            # Resume timer for specified user
-            if username:
-                self.enforcer.set_paused(username, False)
-                self.notifier.send_paused_notification(username, False)
-                self.mqtt_client.publish_event("pause_changed", username, {"paused": False})
-            else:
-                for user in self.config.users:
-                    self.enforcer.set_paused(user.username, False)
-                    self.notifier.send_paused_notification(user.username, False)
-                    self.mqtt_client.publish_event("pause_changed", user.username, {"paused": False})
+        elif action in ("pause", "resume"):
+            # Pause or resume timer for specified user or all controlled users
+            paused = action == "pause"
+            for target in self._command_targets(username):
+                self.enforcer.set_paused(target, paused)
+                self.notifier.send_paused_notification(target, paused)
+                self.mqtt_client.publish_event("pause_changed", target, {"paused": paused})
 
         elif action == "add_time":
-            # Add bonus time for specified user
+            # Add bonus time for specified user or all controlled users
             minutes = command.get("minutes", 15)
-            if username:
-                self.enforcer.add_bonus_time(username, minutes)
-                self.notifier.send_bonus_time_notification(username, minutes)
-                self.mqtt_client.publish_event("bonus_time", username, {"minutes": minutes})
-            else:
-                for user in self.config.users:
-                    self.enforcer.add_bonus_time(user.username, minutes)
-                    self.notifier.send_bonus_time_notification(user.username, minutes)
-                    self.mqtt_client.publish_event("bonus_time", user.username, {"minutes": minutes})
+            for target in self._command_targets(username):
+                self.enforcer.add_bonus_time(target, minutes)
+                self.notifier.send_bonus_time_notification(target, minutes)
+                self.mqtt_client.publish_event("bonus_time", target, {"minutes": minutes})
 
         elif action == "shutdown":
             delay = command.get("delay", 0)
@@ -221,32 +232,19 @@ class KidlockAgent:
                 })
 
         elif action == "approve_request":
-            # Parent approves time request
-            if username:
-                minutes = self.enforcer.approve_request(username)
+            # Parent approves the user's (or every) pending time request
+            for target in self._command_targets(username):
+                minutes = self.enforcer.approve_request(target)
                 if minutes:
-                    self.notifier.send_request_approved(username, minutes)
-                    self.mqtt_client.publish_event("request_approved", username, {"minutes": minutes})
-            else:
-                # Approve all pending requests
-                for user in self.config.users:
-                    minutes = self.enforcer.approve_request(user.username)
-                    if minutes:
-                        self.notifier.send_request_approved(user.username, minutes)
-                        self.mqtt_client.publish_event("request_approved", user.username, {"minutes": minutes})
+                    self.notifier.send_request_approved(target, minutes)
+                    self.mqtt_client.publish_event("request_approved", target, {"minutes": minutes})
 
         elif action == "deny_request":
-            # Parent denies time request
-            if username:
-                if self.enforcer.deny_request(username):
-                    self.notifier.send_request_denied(username)
-                    self.mqtt_client.publish_event("request_denied", username)
-            else:
-                # Deny all pending requests
-                for user in self.config.users:
-                    if self.enforcer.deny_request(user.username):
-                        self.notifier.send_request_denied(user.username)
-                        self.mqtt_client.publish_event("request_denied", user.username)
+            # Parent denies the user's (or every) pending time request
+            for target in self._command_targets(username):
+                if self.enforcer.deny_request(target):
+                    self.notifier.send_request_denied(target)
+                    self.mqtt_client.publish_event("request_denied", target)
 
         elif action == "set_daily_limit":
             # Set daily time limit for a user (from HA number entity)
@@ -297,42 +295,126 @@ class KidlockAgent:
             log.warning(f"Unknown command: {action}")
 
     def _check_file_requests(self) -> None:
-        """Check for file-based time requests from tray app."""
-        if not REQUEST_DIR.exists():
+        """Check for file-based time requests from tray app.
+
+        The tray writes "<user>.json" by renaming a hidden temp file into
+        place, so every *.json entry is complete. Claimed files left behind
+        by a dead agent are swept; anything else is ignored.
+        The directory is only listed when its mtime has changed since the
+        last scan that emptied it, so an idle pass costs a single stat().
+        """
+        try:
+            mtime = REQUEST_DIR.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._request_dir_mtime:
             return
 
-        for request_file in REQUEST_DIR.glob("*.json"):
-            try:
-                with open(request_file) as f:
-                    data = json.load(f)
-
-                username = data.get("username")
-                minutes = data.get("minutes", 15)
-                reason = data.get("reason", "")
-
-                # Validate user is controlled
-                if username and self.config.get_user(username):
-                    # Only create request if user doesn't already have one
-                    if not self.enforcer.has_pending_request(username):
-                        request = self.enforcer.create_time_request(username, minutes, reason)
-                        self.notifier.send_request_submitted(username)
-                        self.mqtt_client.publish_event("time_request", username, {
-                            "request_id": request["id"],
-                            "minutes": minutes,
-                            "reason": reason,
-                        })
-                        log.info(f"Processed file request from {username}: {minutes}m")
-
-                # Remove processed request file
-                request_file.unlink()
-
-            except Exception as e:
-                log.error(f"Error processing request file {request_file}: {e}")
-                # Remove invalid file
+        pending = False
+        with os.scandir(REQUEST_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith(".taken"):
+                    # Rescan until a fresh claim is gone or old enough to sweep
+                    pending |= not self._remove_stale_claim(entry)
+                    continue
+                if not entry.name.endswith(".json"):
+                    continue
                 try:
-                    request_file.unlink()
-                except Exception:
-                    pass
+                    # Never follow links: a dangling symlink or a file claimed
+                    # by another agent meanwhile must not abort the scan
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if st.st_size == 0:
+                    # Older trays wrote in place, so a fresh empty file may still
+                    # be in progress; a stale one (crashed tray, stray touch)
+                    # would otherwise keep the directory rescanned forever
+                    if time.time() - st.st_mtime < EMPTY_REQUEST_GRACE_SECONDS:
+                        pending = True
+                    else:
+                        self._remove_request_file(entry.path)
+                    continue
+                pending = True
+                self._process_request_file(entry.path)
+
+        # Our own unlinks bump the mtime, so the next pass rescans once; the
+        # mtime taken before listing guards against files added meanwhile
+        self._request_dir_mtime = None if pending else mtime
+
+    @staticmethod
+    def _remove_request_file(request_file: str) -> None:
+        """Remove an abandoned request file, ignoring races with other agents."""
+        try:
+            os.unlink(request_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.error(f"Error removing request file {request_file}: {e}")
+
+    @classmethod
+    def _remove_stale_claim(cls, entry: os.DirEntry) -> bool:
+        """Remove a claimed request file left behind by an agent that died.
+
+        rename() updates the ctime, so a claim older than STALE_CLAIM_SECONDS
+        is no longer being processed by any agent. Returns False while the
+        claim is still fresh.
+        """
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            return True
+        if time.time() - st.st_ctime < STALE_CLAIM_SECONDS:
+            return False
+        cls._remove_request_file(entry.path)
+        return True
+
+    def _process_request_file(self, request_file: str) -> None:
+        """Create a time request from a single request file and remove it.
+
+        The file is first claimed by renaming it away from its *.json name,
+        so a second agent racing on REQUEST_DIR skips it. REQUEST_DIR is
+        world-writable, so symlinks, FIFOs and oversized files are rejected
+        before anything is read.
+        """
+        claimed = f"{request_file}.{os.getpid()}.taken"
+        try:
+            os.rename(request_file, claimed)
+        except FileNotFoundError:
+            return  # Already claimed by another agent
+        except OSError as e:
+            log.error(f"Error claiming request file {request_file}: {e}")
+            return
+
+        try:
+            fd = os.open(claimed, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+            with os.fdopen(fd, "rb") as f:
+                st = os.fstat(fd)
+                if not stat.S_ISREG(st.st_mode) or st.st_size > MAX_REQUEST_BYTES:
+                    raise ValueError("not a regular file or too large")
+                data = fastjson.loads(f.read(MAX_REQUEST_BYTES))
+
+            username = data.get("username")
+            minutes = data.get("minutes", 15)
+            reason = data.get("reason", "")
+
+            # Validate user is controlled
+            if username and self.config.get_user(username):
+                # Only create request if user doesn't already have one
+                if not self.enforcer.has_pending_request(username):
+                    request = self.enforcer.create_time_request(username, minutes, reason)
+                    self.notifier.send_request_submitted(username)
+                    self.mqtt_client.publish_event("time_request", username, {
+                        "request_id": request["id"],
+                        "minutes": minutes,
+                        "reason": reason,
+                    })
+                    log.info(f"Processed file request from {username}: {minutes}m")
+
+        except Exception as e:
+            log.error(f"Error processing request file {request_file}: {e}")
+        finally:
+            # Processed or invalid, the claimed file is never needed again
+            self._remove_request_file(claimed)
 
     def _on_settings(self, settings: dict) -> None:
         """Handle incoming settings update from HA."""
@@ -350,33 +432,48 @@ class KidlockAgent:
 
         # TODO: Handle per-user settings updates
 
-    def _check_and_enforce(self) -> None:
+    def _check_tamper(self) -> None:
+        """Check for clock tampering and publish state changes."""
+        if not self.config.activity.tamper_detection:
+            return
+
+        tampered, msg = self.tamper_detector.check()
+        if tampered and not self._tamper_detected:
+            log.warning(f"Clock tamper detected: {msg}")
+            self.mqtt_client.publish_event("clock_tamper", "system", {"message": msg})
+            self.mqtt_client.publish_tamper_state(True, msg)
+            self._tamper_detected = True
+        elif not tampered and self._tamper_detected:
+            self.mqtt_client.publish_tamper_state(False)
+            self._tamper_detected = False
+
+    def _check_and_enforce(self, logged_in: set[str]) -> None:
         """Check all controlled users and enforce rules."""
-        logged_in = self.enforcer.get_logged_in_users()
+        activity = self.config.activity
 
         # Track app usage for logged-in users
-        if self.config.activity.track_apps:
-            for username in logged_in:
-                window = self.platform.get_user_active_window(username)
+        if activity.track_apps:
+            windows = self._query_users(self.platform.get_user_active_window, logged_in)
+            for username, window in windows.items():
                 self.app_tracker.update(username, window)
 
-        for user_config in self.config.users:
-            username = user_config.username
-            is_logged_in = username in logged_in
-            was_logged_in = username in self._last_logged_in
-
-            # Detect login/logout events
-            if is_logged_in and not was_logged_in:
+        # Detect login/logout events (the deltas are usually empty)
+        for username in logged_in - self._last_logged_in:
+            if self.config.get_user(username):
                 self.mqtt_client.publish_event("login", username)
                 log.info(f"User {username} logged in")
-            elif not is_logged_in and was_logged_in:
+        for username in self._last_logged_in - logged_in:
+            if self.config.get_user(username):
                 self.mqtt_client.publish_event("logout", username)
                 log.info(f"User {username} logged out")
 
+        for user_config in self.config.users:
+            username = user_config.username
+            is_logged_in = username in logged_in
+
             # Check pause auto-resume
             if self.enforcer.is_paused(username):
-                auto_resume_min = self.config.activity.pause_auto_resume
-                if self.enforcer.check_pause_auto_resume(username, auto_resume_min):
+                if self.enforcer.check_pause_auto_resume(username, activity.pause_auto_resume):
                     self.notifier.send_paused_notification(username, False)
                     self.mqtt_client.publish_event("pause_changed", username, {"paused": False, "auto": True})
 
@@ -400,8 +497,8 @@ class KidlockAgent:
             # Publish status for each user
             self._publish_user_status(user_config, is_logged_in and allowed)
 
-        # Update tracking for next iteration
-        self._last_logged_in = logged_in.copy()
+        # Update tracking for next iteration (the set is never mutated, so no copy)
+        self._last_logged_in = logged_in
 
     def _check_and_send_warnings(self, user_config) -> None:
         """Check and send time warnings for a user."""
@@ -411,12 +508,16 @@ class KidlockAgent:
         if daily_limit <= 0:
             return  # No limit, no warnings
 
+        # Nothing can be due until remaining time drops to the largest threshold
+        remaining = self.enforcer.get_time_remaining(username, daily_limit)
+        if remaining > max(user_config.warnings, default=-1):
+            return
+
         warnings_to_send = self.enforcer.get_warnings_to_send(
             username, daily_limit, user_config.warnings
         )
 
         for threshold in warnings_to_send:
-            remaining = self.enforcer.get_time_remaining(username, daily_limit)
             if self.notifier.send_time_warning(username, remaining):
                 self.enforcer.mark_warning_sent(username, threshold)
                 self.mqtt_client.publish_event("time_warning", username, {
@@ -460,35 +561,63 @@ class KidlockAgent:
             schedule_weekend=user_config.schedule.weekend,
         )
 
-    def _account_usage(self) -> None:
-        """Account usage time for logged-in users."""
-        now = time.time()
-        elapsed_minutes = int((now - self._last_check) / 60)
-        self._last_check = now
+    def _account_usage(self, logged_in: set[str]) -> None:
+        """Account usage time for logged-in users.
 
-        if elapsed_minutes < 1:
-            return
+        Seconds accumulate per user across passes and are charged in whole
+        minutes; the idle/lock probe only runs when a user's minute is due.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_check
+        self._last_check = now
 
-        logged_in = self.enforcer.get_logged_in_users()
         idle_threshold = self.config.activity.idle_threshold_minutes * 60  # Convert to seconds
 
+        due_users = []
         for user_config in self.config.users:
             username = user_config.username
             if username not in logged_in or self.enforcer.is_paused(username):
+                # Partial minutes don't carry over a logout or pause
+                self._usage_seconds.pop(username, None)
                 continue
 
-            # Check idle/locked state (only if idle detection is enabled)
+            self._usage_seconds[username] += elapsed
+            if self._usage_seconds[username] >= 60:
+                due_users.append(username)
+
+        # Check idle/locked state (only if idle detection is enabled)
+        idle = {}
+        if idle_threshold > 0:
+            def is_idle(username: str) -> bool:
+                return (
+                    self.platform.is_session_locked(username)
+                    or self.platform.get_user_idle_seconds(username) >= idle_threshold
+                )
+
+            idle = self._query_users(is_idle, due_users)
+
+        for username in due_users:
             if idle_threshold > 0:
-                idle_secs = self.platform.get_user_idle_seconds(username)
-                is_locked = self.platform.is_session_locked(username)
+                self.enforcer.set_idle(username, idle[username])
+                if idle[username]:
+                    # Don't count time when idle or locked
+                    del self._usage_seconds[username]
+                    continue
 
-                if idle_secs >= idle_threshold or is_locked:
-                    self.enforcer.set_idle(username, True)
-                    continue  # Don't count time when idle or locked
-                else:
-                    self.enforcer.set_idle(username, False)
+            minutes, remainder = divmod(self._usage_seconds[username], 60)
+            self._usage_seconds[username] = remainder
+            self.enforcer.add_usage(username, int(minutes))
+
+    def _query_users(self, query: Callable[[str], T], usernames: Iterable[str]) -> dict[str, T]:
+        """Run a blocking per-user platform query for several users at once.
 
-            self.enforcer.add_usage(username, elapsed_minutes)
+        The queries spawn subprocesses with multi-second timeouts, so one
+        unresponsive session would otherwise delay every other user's check.
+        """
+        usernames = list(usernames)
+        if len(usernames) <= 1:
+            return {username: query(username) for username in usernames}
+        return dict(zip(usernames, self._query_executor.map(query, usernames), strict=True))
 
     def run(self) -> None:
         """Run the agent."""
@@ -519,39 +648,47 @@ class KidlockAgent:
         REQUEST_DIR.mkdir(parents=True, exist_ok=True)
         os.chmod(REQUEST_DIR, 0o777)  # Allow all users to write requests
 
-        self._running = True
-        self._last_check = time.time()
+        self._last_check = time.monotonic()
         log.info("Kidlock agent running")
 
-        # Main loop
+        # Main loop: passes start every check_interval seconds (not that long
+        # after the previous pass ended), and request_stop() wakes the wait
+        # at once
         check_interval = self.config.activity.poll_interval
+        next_pass = time.monotonic()
         try:
-            while self._running:
-                # Check for clock tampering
-                if self.config.activity.tamper_detection:
-                    tampered, msg = self.tamper_detector.check()
-                    if tampered and not self._tamper_detected:
-                        log.warning(f"Clock tamper detected: {msg}")
-                        self.mqtt_client.publish_event("clock_tamper", "system", {"message": msg})
-                        self.mqtt_client.publish_tamper_state(True, msg)
-                        self._tamper_detected = True
-                    elif not tampered and self._tamper_detected:
-                        self.mqtt_client.publish_tamper_state(False)
-                        self._tamper_detected = False
-
-                self._check_and_enforce()
-                self._account_usage()
-                self._check_file_requests()
-                time.sleep(check_interval)
+            while not self._stop_event.is_set():
+                # Send this pass's MQTT messages together once it completes
+                logged_in = self.enforcer.get_logged_in_users()
+                with self.mqtt_client.batch():
+                    self._check_tamper()
+                    self._check_and_enforce(logged_in)
+                    self._account_usage(logged_in)
+                    self._check_file_requests()
+                self.enforcer.flush()
+
+                next_pass = max(next_pass + check_interval, time.monotonic())
+                self._stop_event.wait(next_pass - time.monotonic())
         except KeyboardInterrupt:
             log.info("Interrupted by user")
         finally:
             self.stop()
 
+    def request_stop(self) -> None:
+        """Ask the main loop to exit after the current pass.
+
+        Only sets an event, so it is safe to call from a signal handler; run()
+        tears down via stop() once the loop has exited.
+        """
+        self._stop_event.set()
+
     def stop(self) -> None:
         """Stop the agent."""
         log.info("Stopping Kidlock agent")
-        self._running = False
+        self.request_stop()
+        self.dns_blocker.flush()
+        self.enforcer.flush()
+        self._query_executor.shutdown(wait=False, cancel_futures=True)
         self.mqtt_client.disconnect()
 
 
@@ -597,7 +734,7 @@ def main() -> None:
 
     # Load config
     try:
-        config = Config.load(config_path)
+        config = Config.load_cached(config_path)
     except FileNotFoundError as e:
         log.error(str(e))
         sys.exit(1)
@@ -612,7 +749,7 @@ def main() -> None:
     # Handle signals
     def signal_handler(sig, frame):
         log.info(f"Received signal {sig}")
-        agent.stop()
+        agent.request_stop()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
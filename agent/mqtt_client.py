@@ -3,11 +3,14 @@
 import json
 import logging
 import threading
-from collections.abc import Callable
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 
+from . import fastjson
 from .config import Config, UserConfig
 
 log = logging.getLogger(__name__)
@@ -15,6 +18,31 @@ log = logging.getLogger(__name__)
 # Home Assistant MQTT Discovery prefix
 HA_DISCOVERY_PREFIX = "homeassistant"
 
+# QoS 1 messages paho may have awaiting PUBACK at once (paho's default is
+# 20); startup discovery sends ~20 retained configs per user, and a small
+# window would release them one broker round-trip at a time
+MAX_INFLIGHT_MESSAGES = 200
+
+# Unchanged per-user state is still re-published this often (seconds)
+USER_STATE_HEARTBEAT = 60.0
+
+# Device status payloads (the offline one doubles as the LWT), encoded once
+STATUS_PAYLOADS = {state: fastjson.dumps({"state": state}) for state in ("online", "offline")}
+
+# (epoch second, ISO timestamp) last formatted by _now_iso()
+_iso_cache: tuple[int, str] = (0, "")
+
+
+def _now_iso() -> str:
+    """Return the local time as an ISO timestamp, formatted once per second."""
+    global _iso_cache
+    now = int(time.time())
+    cached_at, iso = _iso_cache
+    if now != cached_at:
+        iso = datetime.fromtimestamp(now).isoformat()
+        _iso_cache = (now, iso)
+    return iso
+
 
 class MqttClient:
     """MQTT client with LWT and command subscription."""
@@ -31,21 +59,28 @@ class MqttClient:
         self._client: mqtt.Client | None = None
         self._connected = threading.Event()
 
-    @property
-    def topic_status(self) -> str:
-        return f"{self.config.topic_prefix}/status"
-
-    @property
-    def topic_activity(self) -> str:
-        return f"{self.config.topic_prefix}/activity"
-
-    @property
-    def topic_command(self) -> str:
-        return f"{self.config.topic_prefix}/command"
-
-    @property
-    def topic_settings(self) -> str:
-        return f"{self.config.topic_prefix}/settings"
+        # Fixed topics, built once (the prefix depends only on the hostname)
+        prefix = config.topic_prefix
+        self.topic_status = f"{prefix}/status"
+        self.topic_activity = f"{prefix}/activity"
+        self.topic_command = f"{prefix}/command"
+        self.topic_settings = f"{prefix}/settings"
+        self.topic_event = f"{prefix}/event"
+        self.topic_tamper = f"{prefix}/tamper"
+
+        # Per-thread list of deferred publishes while inside batch()
+        self._local = threading.local()
+        # username -> per-user state topic
+        self._user_topics: dict[str, str] = {}
+        # username -> (last published state payload, monotonic time sent)
+        self._user_payloads: dict[str, tuple[bytes, float]] = {}
+
+    def topic_user(self, username: str) -> str:
+        """Return a user's state topic, built once per user."""
+        topic = self._user_topics.get(username)
+        if topic is None:
+            topic = self._user_topics[username] = f"{self.config.topic_prefix}/user/{username}"
+        return topic
 
     def connect(self) -> None:
         """Connect to MQTT broker."""
@@ -70,11 +105,12 @@ class MqttClient:
                 self.config.mqtt.password,
             )
 
+        self._client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+
         # Set Last Will Testament for offline detection
-        lwt_payload = json.dumps({"state": "offline"})
         self._client.will_set(
             self.topic_status,
-            payload=lwt_payload,
+            payload=STATUS_PAYLOADS["offline"],
             qos=1,
             retain=True,
         )
@@ -105,18 +141,54 @@ class MqttClient:
         """Wait for connection to be established."""
         return self._connected.wait(timeout)
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer publishes made by this thread until the block exits.
+
+        The queued messages are then handed to paho back-to-back, so its
+        network thread flushes them in one go instead of being woken between
+        each step of an enforcement pass. Nested batches join the outer one.
+        """
+        if getattr(self._local, "pending", None) is not None:
+            yield
+            return
+
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            for topic, payload, qos, retain in pending:
+                self._publish(topic, payload, qos, retain)
+
+    def _publish(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        """Publish a message now, or queue it if this thread is in a batch."""
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            pending.append((topic, payload, qos, retain))
+        else:
+            self._client.publish(topic, payload, qos=qos, retain=retain)
+
     def publish_status(self, state: str) -> None:
         """Publish device status."""
         if self._client:
-            payload = json.dumps({"state": state})
-            self._client.publish(self.topic_status, payload, qos=1, retain=True)
-            log.debug(f"Published status: {state}")
+            payload = STATUS_PAYLOADS.get(state) or fastjson.dumps({"state": state})
+            self._publish(self.topic_status, payload, qos=1, retain=True)
+            log.debug("Published status: %s", state)
 
     def publish_ha_discovery(self, users: list[UserConfig]) -> None:
         """Publish Home Assistant MQTT discovery messages."""
         if not self._client:
             return
 
+        # Queue every config message and hand them to paho together
+        with self.batch():
+            self._publish_ha_discovery(users)
+        log.info(f"Published HA discovery for {len(users)} users")
+
+    def _publish_ha_discovery(self, users: list[UserConfig]) -> None:
+        """Build and publish the discovery messages for the device and users."""
+
         hostname = self.config.device.hostname
         device_info = {
             "identifiers": [f"kidlock_{hostname}"],
@@ -142,7 +214,7 @@ class MqttClient:
             "name": f"{hostname} Clock Tamper",
             "unique_id": f"kidlock_{hostname}_clock_tamper",
             "device": device_info,
-            "state_topic": f"{self.config.topic_prefix}/tamper",
+            "state_topic": self.topic_tamper,
             "value_template": "{{ 'ON' if value_json.tampered else 'OFF' }}",
             "device_class": "tamper",
             "icon": "mdi:clock-alert",
@@ -151,8 +223,10 @@ class MqttClient:
         # Per-user entities
         for user in users:
             username = user.username
-            user_topic = f"{self.config.topic_prefix}/user/{username}"
+            user_topic = self.topic_user(username)
             user_id = f"{hostname}_{username}"
+            # Command payloads below splice in the JSON-encoded name once
+            user_json = json.dumps(username)
 
             # User active binary sensor
             self._publish_discovery("binary_sensor", f"{user_id}_active", {
@@ -212,7 +286,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_lock",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "lock", "user": username}),
+                "payload_press": f'{{"action": "lock", "user": {user_json}}}',
                 "icon": "mdi:lock",
             })
 
@@ -222,7 +296,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_unlock",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "unlock", "user": username}),
+                "payload_press": f'{{"action": "unlock", "user": {user_json}}}',
                 "icon": "mdi:lock-open",
             })
 
@@ -255,8 +329,8 @@ class MqttClient:
                 "state_topic": user_topic,
                 "value_template": "{{ 'ON' if value_json.paused else 'OFF' }}",
                 "command_topic": self.topic_command,
-                "payload_on": json.dumps({"action": "pause", "user": username}),
-                "payload_off": json.dumps({"action": "resume", "user": username}),
+                "payload_on": f'{{"action": "pause", "user": {user_json}}}',
+                "payload_off": f'{{"action": "resume", "user": {user_json}}}',
                 "icon": "mdi:pause-circle",
             })
 
@@ -266,7 +340,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_add_15min",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "add_time", "user": username, "minutes": 15}),
+                "payload_press": f'{{"action": "add_time", "user": {user_json}, "minutes": 15}}',
                 "icon": "mdi:clock-plus",
             })
 
@@ -276,7 +350,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_add_30min",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "add_time", "user": username, "minutes": 30}),
+                "payload_press": f'{{"action": "add_time", "user": {user_json}, "minutes": 30}}',
                 "icon": "mdi:clock-plus-outline",
             })
 
@@ -348,7 +422,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_approve_request",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "approve_request", "user": username}),
+                "payload_press": f'{{"action": "approve_request", "user": {user_json}}}',
                 "icon": "mdi:check-circle",
             })
 
@@ -358,7 +432,7 @@ class MqttClient:
                 "unique_id": f"kidlock_{user_id}_deny_request",
                 "device": device_info,
                 "command_topic": self.topic_command,
-                "payload_press": json.dumps({"action": "deny_request", "user": username}),
+                "payload_press": f'{{"action": "deny_request", "user": {user_json}}}',
                 "icon": "mdi:close-circle",
             })
 
@@ -405,12 +479,10 @@ class MqttClient:
                 "pattern": r"[0-2][0-9]:[0-5][0-9]-[0-2][0-9]:[0-5][0-9]",
             })
 
-        log.info(f"Published HA discovery for {len(users)} users")
-
     def _publish_discovery(self, component: str, object_id: str, config: dict) -> None:
         """Publish a single HA discovery message."""
         topic = f"{HA_DISCOVERY_PREFIX}/{component}/kidlock/{object_id}/config"
-        self._client.publish(topic, json.dumps(config), qos=1, retain=True)
+        self._publish(topic, fastjson.dumps(config), qos=1, retain=True)
 
     def publish_activity(
         self,
@@ -421,14 +493,14 @@ class MqttClient:
     ) -> None:
         """Publish activity data (legacy single-user mode)."""
         if self._client:
-            payload = json.dumps({
+            payload = fastjson.dumps({
                 "active_window": active_window or "",
                 "idle_seconds": idle_seconds,
                 "usage_minutes": usage_minutes,
                 "blocking_enabled": blocking_enabled,
             })
-            self._client.publish(self.topic_activity, payload, qos=0, retain=False)
-            log.debug(f"Published activity: window={active_window}, idle={idle_seconds}s, blocking={blocking_enabled}")
+            self._publish(self.topic_activity, payload, qos=0, retain=False)
+            log.debug("Published activity: window=%s, idle=%ss, blocking=%s", active_window, idle_seconds, blocking_enabled)
 
     def publish_user_activity(
         self,
@@ -450,9 +522,14 @@ class MqttClient:
         schedule_weekday: str = "00:00-23:59",
         schedule_weekend: str = "00:00-23:59",
     ) -> None:
-        """Publish per-user activity data."""
+        """Publish per-user activity data.
+
+        Identical state is skipped until USER_STATE_HEARTBEAT has passed. Only
+        changed state is retained; the broker already holds the same payload
+        for new subscribers, so heartbeats don't rewrite its retained store.
+        """
         if self._client:
-            topic = f"{self.config.topic_prefix}/user/{username}"
+            topic = self.topic_user(username)
             # Format top apps as list of dicts with minutes
             top_apps_data = []
             if top_apps:
@@ -460,7 +537,7 @@ class MqttClient:
                     {"app": app, "minutes": secs // 60}
                     for app, secs in top_apps
                 ]
-            payload = json.dumps({
+            payload = fastjson.dumps({
                 "username": username,
                 "active": active,
                 "usage_minutes": usage_minutes,
@@ -480,8 +557,17 @@ class MqttClient:
                 "schedule_weekday": schedule_weekday,
                 "schedule_weekend": schedule_weekend,
             })
-            self._client.publish(topic, payload, qos=0, retain=True)
-            log.debug(f"Published user activity: {username} active={active} usage={usage_minutes}m remaining={time_remaining}m idle={is_idle}")
+            now = time.monotonic()
+            last = self._user_payloads.get(username)
+            changed = last is None or last[0] != payload
+            if not changed and now - last[1] < USER_STATE_HEARTBEAT:
+                return
+            self._user_payloads[username] = (payload, now)
+            self._publish(topic, payload, qos=0, retain=changed)
+            log.debug(
+                "Published user activity: %s active=%s usage=%sm remaining=%sm idle=%s",
+                username, active, usage_minutes, time_remaining, is_idle,
+            )
 
     def publish_event(
         self,
@@ -494,28 +580,26 @@ class MqttClient:
         Event types: login, logout, time_warning, time_exhausted, pause_changed, clock_tamper
         """
         if self._client:
-            topic = f"{self.config.topic_prefix}/event"
             payload = {
                 "event": event_type,
                 "user": username,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": _now_iso(),
             }
             if data:
                 payload.update(data)
-            self._client.publish(topic, json.dumps(payload), qos=1, retain=False)
-            log.debug(f"Published event: {event_type} for {username}")
+            self._publish(self.topic_event, fastjson.dumps(payload), qos=1, retain=False)
+            log.debug("Published event: %s for %s", event_type, username)
 
     def publish_tamper_state(self, tampered: bool, message: str = "") -> None:
         """Publish clock tamper detection state."""
         if self._client:
-            topic = f"{self.config.topic_prefix}/tamper"
-            payload = json.dumps({
+            payload = fastjson.dumps({
                 "tampered": tampered,
                 "message": message,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": _now_iso(),
             })
-            self._client.publish(topic, payload, qos=1, retain=True)
-            log.debug(f"Published tamper state: {tampered}")
+            self._publish(self.topic_tamper, payload, qos=1, retain=True)
+            log.debug("Published tamper state: %s", tampered)
 
     def _on_connect(
         self,
@@ -528,6 +612,8 @@ class MqttClient:
         if rc == 0:
             log.info("Connected to MQTT broker")
             self._connected.set()
+            # Re-send full user state after a (re)connect
+            self._user_payloads.clear()
 
             # Subscribe to command topic
             client.subscribe(self.topic_command, qos=1)
@@ -563,7 +649,7 @@ class MqttClient:
     ) -> None:
         """Handle incoming message."""
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = fastjson.loads(msg.payload)
 
             if msg.topic == self.topic_settings:
                 log.info(f"Received settings: {payload}")
@@ -574,7 +660,7 @@ class MqttClient:
                 self.on_command(payload)
             else:
                 log.warning(f"Unknown topic: {msg.topic}")
-        except json.JSONDecodeError as e:
+        except fastjson.JSONDecodeError as e:
             log.error(f"Invalid JSON in message: {e}")
         except Exception as e:
             log.error(f"Error handling message: {e}")
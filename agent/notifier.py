@@ -3,9 +3,15 @@
 import logging
 import os
 import subprocess
+import time
+
+from .platform.linux import _get_uid, query_sessions
 
 log = logging.getLogger(__name__)
 
+# How long a user's DISPLAY and uid are reused between notifications (seconds)
+USER_ENV_CACHE_SECONDS = 60.0
+
 
 class Notifier:
     """Sends desktop notifications to users."""
@@ -15,69 +21,32 @@ class Notifier:
     URGENCY_NORMAL = "normal"
     URGENCY_CRITICAL = "critical"
 
+    # username -> (DISPLAY, uid, monotonic expiry) of a logged-in session
+    _user_env_cache: dict[str, tuple[str, int | None, float]] = {}
+
     @staticmethod
     def _get_user_display(username: str) -> str | None:
         """Get the DISPLAY environment variable for a logged-in user."""
-        try:
-            # Find user's display from their session
-            result = subprocess.run(
-                ["loginctl", "list-sessions", "--no-legend"],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            for line in result.stdout.strip().split("\n"):
-                if not line:
-                    continue
-                parts = line.split()
-                if len(parts) >= 3:
-                    session_id = parts[0]
-                    user = parts[2]
-                    if user == username:
-                        # Get display for this session
-                        show_result = subprocess.run(
-                            ["loginctl", "show-session", session_id, "-p", "Display"],
-                            capture_output=True,
-                            text=True,
-                            timeout=5,
-                        )
-                        display_line = show_result.stdout.strip()
-                        if display_line.startswith("Display=") and len(display_line) > 8:
-                            return display_line.split("=", 1)[1]
-            return None
-        except Exception as e:
-            log.debug(f"Could not get display for {username}: {e}")
-            return None
+        info = query_sessions().get(username)
+        return info.display if info else None
 
-    @staticmethod
-    def _get_user_dbus(username: str) -> str | None:
-        """Get the DBUS_SESSION_BUS_ADDRESS for a logged-in user."""
-        try:
-            # Try to find the dbus address from the user's session
-            result = subprocess.run(
-                ["su", "-", username, "-c", "echo $DBUS_SESSION_BUS_ADDRESS"],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            addr = result.stdout.strip()
-            if addr:
-                return addr
+    @classmethod
+    def _get_user_env(cls, username: str) -> tuple[str, int | None]:
+        """Get a user's DISPLAY and uid, cached while they have a session.
 
-            # Fallback: construct from user ID
-            uid_result = subprocess.run(
-                ["id", "-u", username],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            uid = uid_result.stdout.strip()
-            if uid:
-                return f"unix:path=/run/user/{uid}/bus"
-            return None
-        except Exception as e:
-            log.debug(f"Could not get DBUS for {username}: {e}")
-            return None
+        Only a display found in a session is cached, so a user who logs in
+        after a notification fell back to ":0" is picked up next time.
+        """
+        now = time.monotonic()
+        cached = cls._user_env_cache.get(username)
+        if cached is not None and cached[2] > now:
+            return cached[0], cached[1]
+
+        uid = _get_uid(username)
+        display = cls._get_user_display(username)
+        if display:
+            cls._user_env_cache[username] = (display, uid, now + USER_ENV_CACHE_SECONDS)
+        return display or ":0", uid
 
     @classmethod
     def send_notification(
@@ -102,36 +71,16 @@ class Notifier:
         Returns:
             True if notification was sent successfully
         """
-        display = cls._get_user_display(username)
-        dbus_addr = cls._get_user_dbus(username)
-
-        if not display:
-            # Default fallback
-            display = ":0"
-
-        if not dbus_addr:
-            # Try to find it from procfs for the user's processes
-            try:
-                uid_result = subprocess.run(
-                    ["id", "-u", username],
-                    capture_output=True,
-                    text=True,
-                    timeout=5,
-                )
-                uid = uid_result.stdout.strip()
-                dbus_addr = f"unix:path=/run/user/{uid}/bus"
-            except Exception:
-                pass
+        try:
+            display, uid = cls._get_user_env(username)
 
-        env = os.environ.copy()
-        env["DISPLAY"] = display
-        if dbus_addr:
-            env["DBUS_SESSION_BUS_ADDRESS"] = dbus_addr
+            env = os.environ.copy()
+            env["DISPLAY"] = display
+            if uid is not None:
+                # systemd's per-user session bus
+                env["DBUS_SESSION_BUS_ADDRESS"] = f"unix:path=/run/user/{uid}/bus"
 
-        try:
-            # Use sudo to run notify-send as the target user
             cmd = [
-                "sudo", "-u", username,
                 "notify-send",
                 "--urgency", urgency,
                 "--icon", icon,
@@ -140,10 +89,14 @@ class Notifier:
                 title,
                 message,
             ]
+            if uid != os.geteuid():
+                # Use sudo to run notify-send as the target user
+                cmd = ["sudo", "-u", username, *cmd]
 
             result = subprocess.run(
                 cmd,
                 env=env,
+                stdin=subprocess.DEVNULL,
                 capture_output=True,
                 timeout=10,
             )
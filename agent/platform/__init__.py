@@ -4,15 +4,27 @@ import sys
 
 from .base import PlatformBase
 
-if sys.platform == "win32":
-    from .windows import WindowsPlatform as Platform
-else:
-    from .linux import LinuxPlatform as Platform
+
+def _platform_class() -> type[PlatformBase]:
+    """Import and return the implementation for this OS (imported on first use)."""
+    if sys.platform == "win32":
+        from .windows import WindowsPlatform
+        return WindowsPlatform
+    from .linux import LinuxPlatform
+    return LinuxPlatform
 
 
 def get_platform() -> PlatformBase:
     """Get the appropriate platform implementation."""
-    return Platform()
+    return _platform_class()()
+
+
+def __getattr__(name: str):
+    # Platform is resolved lazily so importing the package (or .base) does not
+    # pull in the OS-specific module and its dependencies
+    if name == "Platform":
+        return _platform_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 __all__ = ["get_platform", "Platform", "PlatformBase"]
@@ -1,16 +1,97 @@
 """Linux platform implementation."""
 
 import logging
+import pwd
 import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from functools import cache
 
 from .base import PlatformBase
 
 log = logging.getLogger(__name__)
 
+# How long a loginctl session snapshot is reused before querying again, in seconds
+SESSION_CACHE_SECONDS = 1.0
+
+
+@dataclass(slots=True)
+class SessionInfo:
+    """loginctl properties of a user's session."""
+
+    session_id: str
+    display: str | None = None
+    locked: bool = False
+
+
+@cache
+def _get_uid(username: str) -> int | None:
+    """Look up a user's uid from the passwd database."""
+    try:
+        return pwd.getpwnam(username).pw_uid
+    except KeyError:
+        return None
+
+
+def query_sessions() -> dict[str, SessionInfo]:
+    """Read every user's session with one list-sessions and one show-session call.
+
+    A user with several sessions gets the first listed one that has a
+    display (their graphical session), otherwise the first listed.
+    """
+    listed: list[tuple[str, SessionInfo]] = []
+    try:
+        result = subprocess.run(
+            ["loginctl", "list-sessions", "--no-legend"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) >= 3:
+                listed.append((parts[2], SessionInfo(session_id=parts[0])))
+        if not listed:
+            return {}
+
+        by_id = {info.session_id: info for _, info in listed}
+        result = subprocess.run(
+            ["loginctl", "show-session", *by_id, "-p", "Id", "-p", "Display", "-p", "LockedHint"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        # One block of Key=value lines per session, separated by blank lines
+        for block in result.stdout.split("\n\n"):
+            props = dict(line.partition("=")[::2] for line in block.splitlines())
+            info = by_id.get(props.get("Id", ""))
+            if info:
+                info.display = props.get("Display") or None
+                info.locked = props.get("LockedHint") == "yes"
+    except (subprocess.SubprocessError, OSError) as e:
+        log.debug(f"loginctl session query failed: {e}")
+
+    sessions: dict[str, SessionInfo] = {}
+    for username, info in listed:
+        current = sessions.get(username)
+        if current is None or (info.display and not current.display):
+            sessions[username] = info
+    return sessions
+
 
 class LinuxPlatform(PlatformBase):
     """Linux-specific implementations using X11 tools."""
 
+    def __init__(self) -> None:
+        # username -> session (see query_sessions), and when it was fetched (monotonic)
+        self._sessions: dict[str, SessionInfo] = {}
+        self._sessions_at: float | None = None
+        # Per-user queries may run concurrently; refresh the snapshot once
+        self._sessions_lock = threading.Lock()
+
     @property
     def name(self) -> str:
         return "linux"
@@ -164,47 +245,23 @@ class LinuxPlatform(PlatformBase):
         except (subprocess.SubprocessError, FileNotFoundError) as e:
             log.error(f"Failed to show warning: {e}")
 
-    def _get_user_session_id(self, username: str) -> str | None:
-        """Get the session ID for a user from loginctl."""
-        try:
-            result = subprocess.run(
-                ["loginctl", "list-sessions", "--no-legend"],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            for line in result.stdout.strip().split("\n"):
-                if not line:
-                    continue
-                parts = line.split()
-                if len(parts) >= 3:
-                    session_id = parts[0]
-                    user = parts[2]
-                    if user == username:
-                        return session_id
-        except (subprocess.SubprocessError, FileNotFoundError):
-            pass
-        return None
+    def _get_sessions(self) -> dict[str, SessionInfo]:
+        """Get each user's session, cached for SESSION_CACHE_SECONDS.
+
+        All per-user lookups in an agent pass (display, lock state) share
+        one snapshot instead of each running loginctl twice.
+        """
+        with self._sessions_lock:
+            now = time.monotonic()
+            if self._sessions_at is None or now - self._sessions_at >= SESSION_CACHE_SECONDS:
+                self._sessions = query_sessions()
+                self._sessions_at = now
+            return self._sessions
 
     def _get_user_display(self, username: str) -> str | None:
         """Get the DISPLAY for a user's session."""
-        session_id = self._get_user_session_id(username)
-        if not session_id:
-            return None
-
-        try:
-            result = subprocess.run(
-                ["loginctl", "show-session", session_id, "-p", "Display"],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            line = result.stdout.strip()
-            if line.startswith("Display=") and len(line) > 8:
-                return line.split("=", 1)[1]
-        except (subprocess.SubprocessError, FileNotFoundError):
-            pass
-        return None
+        info = self._get_sessions().get(username)
+        return info.display if info else None
 
     def get_user_idle_seconds(self, username: str) -> int:
         """Get idle time for a user's X session using xprintidle."""
@@ -212,16 +269,12 @@ class LinuxPlatform(PlatformBase):
         if not display:
             return 0
 
-        try:
-            # Get user's uid for XAUTHORITY path
-            uid_result = subprocess.run(
-                ["id", "-u", username],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            uid = uid_result.stdout.strip()
+        # Get user's uid for XAUTHORITY path
+        uid = _get_uid(username)
+        if uid is None:
+            return 0
 
+        try:
             # Run xprintidle as the user with their DISPLAY
             env = {
                 "DISPLAY": display,
@@ -252,23 +305,8 @@ class LinuxPlatform(PlatformBase):
 
     def is_session_locked(self, username: str) -> bool:
         """Check if user's session is locked via loginctl."""
-        session_id = self._get_user_session_id(username)
-        if not session_id:
-            return False
-
-        try:
-            result = subprocess.run(
-                ["loginctl", "show-session", session_id, "-p", "LockedHint"],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            line = result.stdout.strip()
-            if line == "LockedHint=yes":
-                return True
-        except (subprocess.SubprocessError, FileNotFoundError):
-            pass
-        return False
+        info = self._get_sessions().get(username)
+        return info.locked if info else False
 
     def get_user_active_window(self, username: str) -> str | None:
         """Get active window title for a user's session using xdotool."""
@@ -276,16 +314,12 @@ class LinuxPlatform(PlatformBase):
         if not display:
             return None
 
-        try:
-            # Get user's uid for XAUTHORITY path
-            uid_result = subprocess.run(
-                ["id", "-u", username],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            uid = uid_result.stdout.strip()
+        # Get user's uid for XAUTHORITY path
+        uid = _get_uid(username)
+        if uid is None:
+            return None
 
+        try:
             # Try common Xauthority locations
             xauth_paths = [
                 f"/run/user/{uid}/gdm/Xauthority",
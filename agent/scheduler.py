@@ -4,7 +4,6 @@ import json
 import logging
 import os
 import threading
-import time
 from collections.abc import Callable
 from datetime import datetime
 from pathlib import Path
@@ -31,6 +30,8 @@ class Scheduler:
         self.on_limit_reached = on_limit_reached
 
         self._running = False
+        # Set by stop() to wake the loop out of its wait immediately
+        self._stop_event = threading.Event()
         self._thread: threading.Thread | None = None
         self._usage_minutes = 0
         self._last_reset_date: str | None = None
@@ -97,6 +98,7 @@ class Scheduler:
             return
 
         self._running = True
+        self._stop_event.clear()
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
         log.info("Scheduler started")
@@ -104,6 +106,7 @@ class Scheduler:
     def stop(self) -> None:
         """Stop the scheduler."""
         self._running = False
+        self._stop_event.set()
         if self._thread:
             self._thread.join(timeout=5)
             self._thread = None
@@ -143,7 +146,7 @@ class Scheduler:
             else:
                 self._locked_for_schedule = False
 
-            time.sleep(10)  # Check every 10 seconds
+            self._stop_event.wait(10)  # Check every 10 seconds
 
     def _is_within_schedule(self) -> bool:
         """Check if current time is within allowed schedule."""
@@ -150,6 +150,9 @@ PrivateTmp=true
 ProtectSystem=strict
 ProtectHome=read-only
 ReadWritePaths=/var/lib/kidlock /etc/NetworkManager/dnsmasq.d
+# Creates /var/cache/kidlock (parsed config cache) writable under ProtectSystem
+CacheDirectory=kidlock
+CacheDirectoryMode=0700
 ProtectKernelTunables=true
 ProtectKernelModules=true
 ProtectControlGroups=true
@@ -51,12 +51,20 @@ def is_within_schedule(schedule: dict) -> bool:
 
     try:
         start_str, end_str = schedule_str.split("-")
-        start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
-        end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
-        return start_time <= now.time() <= end_time
+        start_time = datetime.strptime(start_str.strip(), "%H:%M")
+        end_time = datetime.strptime(end_str.strip(), "%H:%M")
     except ValueError:
         return True
 
+    # Minute resolution with an inclusive end, matching the agent; a window
+    # ending before it starts (e.g. "22:00-06:00") wraps around midnight
+    start = start_time.hour * 60 + start_time.minute
+    end = end_time.hour * 60 + end_time.minute
+    current = now.hour * 60 + now.minute
+    if start <= end:
+        return start <= current <= end
+    return current >= start or current <= end
+
 
 def check_login(username: str) -> tuple[bool, str]:
     """Check if user should be allowed to log in."""
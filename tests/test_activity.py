@@ -0,0 +1,53 @@
+"""Tests for activity module."""
+
+from unittest.mock import MagicMock
+
+from agent.activity import ActivityMonitor
+from agent.config import ActivityConfig
+
+
+def make_monitor(idle_seconds: int, idle_threshold_minutes: int = 5):
+    """Create a monitor whose callback stops it after one poll."""
+    platform = MagicMock()
+    platform.get_idle_seconds.return_value = idle_seconds
+    platform.get_active_window.return_value = "Firefox"
+    on_activity = MagicMock()
+    config = ActivityConfig(idle_threshold_minutes=idle_threshold_minutes)
+    monitor = ActivityMonitor.from_config(platform, config, on_activity)
+    on_activity.side_effect = lambda *_: monitor._stop_event.set()
+    return monitor, platform, on_activity
+
+
+class TestActivityMonitor:
+    """Tests for the activity polling loop."""
+
+    def test_from_config(self):
+        """Test that the poll interval and idle threshold come from config."""
+        config = ActivityConfig(poll_interval=30, idle_threshold_minutes=2)
+        monitor = ActivityMonitor.from_config(MagicMock(), config, MagicMock())
+        assert monitor.poll_interval == 30
+        assert monitor.idle_threshold_seconds == 120
+
+    def test_window_queried_while_active(self):
+        """Test that the active window is reported below the idle threshold."""
+        monitor, platform, on_activity = make_monitor(idle_seconds=60)
+        monitor._run()
+
+        platform.get_active_window.assert_called_once()
+        on_activity.assert_called_once_with("Firefox", 60)
+
+    def test_window_query_skipped_while_idle(self):
+        """Test that the window query is skipped once idle past the threshold."""
+        monitor, platform, on_activity = make_monitor(idle_seconds=301)
+        monitor._run()
+
+        platform.get_active_window.assert_not_called()
+        on_activity.assert_called_once_with(None, 301)
+
+    def test_threshold_disabled(self):
+        """Test that a threshold of 0 always queries the window."""
+        monitor, platform, on_activity = make_monitor(idle_seconds=3600, idle_threshold_minutes=0)
+        monitor._run()
+
+        platform.get_active_window.assert_called_once()
+        on_activity.assert_called_once_with("Firefox", 3600)
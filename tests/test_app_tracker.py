@@ -0,0 +1,120 @@
+"""Tests for app_tracker module."""
+
+import pytest
+
+from agent.app_tracker import AppTracker, extract_app_name
+
+
+class TestExtractAppName:
+    """Tests for window title parsing."""
+
+    @pytest.fixture
+    def tracker(self):
+        return AppTracker()
+
+    @pytest.mark.parametrize(
+        "title,expected",
+        [
+            ("GitHub - Mozilla Firefox", "Firefox"),
+            ("Inbox — Firefox", "Firefox"),
+            ("YouTube - Google Chrome", "Chrome"),
+            ("Search - chromium", "Chrome"),
+            ("News - Brave", "Brave"),
+            ("Docs - Microsoft Edge", "Edge"),
+        ],
+    )
+    def test_browser_titles(self, tracker, title, expected):
+        """Test that browser titles map to the browser name."""
+        assert tracker._extract_app_name(title) == expected
+
+    def test_dash_suffix(self, tracker):
+        """Test 'Document - Application' format."""
+        assert tracker._extract_app_name("notes.txt - gedit") == "gedit"
+
+    def test_em_dash_suffix(self, tracker):
+        """Test 'Document — Application' format."""
+        assert tracker._extract_app_name("main.py — Kate") == "Kate"
+
+    def test_rightmost_separator_wins(self, tracker):
+        """Test that the last dash or em-dash separates the app name."""
+        assert tracker._extract_app_name("a - b — Kate") == "Kate"
+        assert tracker._extract_app_name("a — b - gedit") == "gedit"
+
+    def test_colon_prefix(self, tracker):
+        """Test 'Application: Document' format."""
+        assert tracker._extract_app_name("Terminal: ~/src") == "Terminal"
+
+    def test_plain_title(self, tracker):
+        """Test that a plain title is returned as-is."""
+        assert tracker._extract_app_name("Minecraft") == "Minecraft"
+
+    def test_long_title_truncated(self, tracker):
+        """Test that long unmatched titles are truncated to 50 chars."""
+        assert tracker._extract_app_name("x" * 80) == "x" * 50
+
+    def test_empty_title(self, tracker):
+        """Test that an empty title is reported as Unknown."""
+        assert tracker._extract_app_name("") == "Unknown"
+
+    def test_results_are_cached(self):
+        """Test that repeated titles are served from the cache."""
+        extract_app_name.cache_clear()
+        extract_app_name("notes.txt - gedit")
+        extract_app_name("notes.txt - gedit")
+        assert extract_app_name.cache_info().hits == 1
+
+
+class TestAppTracker:
+    """Tests for AppTracker usage accounting."""
+
+    def test_day_check_is_throttled(self):
+        """Test that the date is only re-checked once per interval."""
+        tracker = AppTracker()
+        tracker._reset_if_new_day()
+        tracker._users["kid"].usage["Firefox"] = 60
+        tracker._usage_ordinal -= 1
+
+        tracker._reset_if_new_day()
+        assert tracker.get_total_tracked_seconds("kid") == 60
+
+        tracker._next_day_check = 0.0
+        tracker._reset_if_new_day()
+        assert tracker.get_total_tracked_seconds("kid") == 0
+
+    def test_get_top_apps(self):
+        """Test that top apps are sorted by time and limited."""
+        tracker = AppTracker()
+        tracker._reset_if_new_day()
+        tracker._users["kid"].usage.update({"Firefox": 60, "Minecraft": 300, "gedit": 5})
+
+        assert tracker.get_top_apps("kid", limit=2) == [("Minecraft", 300), ("Firefox", 60)]
+        assert tracker.get_top_apps("nobody") == []
+        assert "nobody" not in tracker._users
+
+    def test_update_accumulates_previous_window(self, monkeypatch):
+        """Test that switching windows credits time to the previous app."""
+        now = [1000.0]
+        monkeypatch.setattr("agent.app_tracker.time.monotonic", lambda: now[0])
+        tracker = AppTracker()
+
+        tracker.update("kid", "World - Minecraft")
+        now[0] += 90
+        tracker.update("kid", "notes.txt - gedit")
+
+        assert tracker.get_top_apps("kid") == [("Minecraft", 90)]
+        assert tracker.get_current_app("kid") == "gedit"
+
+    def test_update_same_window_is_noop(self, monkeypatch):
+        """Test that re-reporting the focused window does not credit time."""
+        now = [1000.0]
+        monkeypatch.setattr("agent.app_tracker.time.monotonic", lambda: now[0])
+        tracker = AppTracker()
+
+        tracker.update("kid", "World - Minecraft")
+        now[0] += 30
+        tracker.update("kid", "World - Minecraft")
+        now[0] += 30
+        tracker.update("kid", None)
+
+        assert tracker.get_top_apps("kid") == [("Minecraft", 60)]
+        assert tracker.get_current_app("kid") is None
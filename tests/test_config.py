@@ -2,6 +2,7 @@
 
 import tempfile
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
 
@@ -48,6 +49,63 @@ class TestConfig:
         assert config.mqtt.broker == "custom.local"
         assert config.mqtt.port == 1883  # Default
 
+    def test_load_ignores_unknown_keys(self):
+        """Test that unknown keys are ignored and missing ones keep defaults."""
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".yaml", delete=False) as f:
+            f.write(
+                "activity:\n  poll_interval: 5\n  bogus: 1\n"
+                "users:\n  - username: kid\n    schedule:\n      weekend: 10:00-12:00\n"
+            )
+            f.flush()
+            config = Config.load(Path(f.name))
+
+        assert config.activity.poll_interval == 5
+        assert config.activity.idle_threshold_minutes == 5  # Default
+        assert config.users[0].schedule.weekday == "00:00-23:59"
+        assert config.users[0].schedule.weekend == "10:00-12:00"
+
+    def test_load_cached_reuses_parse(self, temp_config_file, tmp_path):
+        """Test that an unchanged config is loaded from the JSON cache."""
+        cache_file = tmp_path / "cache" / "config.json"
+        config = Config.load_cached(temp_config_file, cache_file)
+        assert cache_file.stat().st_mode & 0o777 == 0o600
+
+        with patch("agent.config._load_yaml") as load_yaml:
+            cached = Config.load_cached(temp_config_file, cache_file)
+            load_yaml.assert_not_called()
+
+        assert cached == config
+        assert cached.get_user("testuser").schedule.weekday == "15:00-20:00"
+
+    def test_load_cached_reparses_changed_file(self, temp_config_file, tmp_path):
+        """Test that editing the config invalidates the cache."""
+        cache_file = tmp_path / "config.json"
+        Config.load_cached(temp_config_file, cache_file)
+
+        temp_config_file.write_text("mqtt:\n  broker: changed.local\n")
+        config = Config.load_cached(temp_config_file, cache_file)
+
+        assert config.mqtt.broker == "changed.local"
+        assert config.users == []
+
+    def test_load_cached_without_writable_cache(self, temp_config_file, tmp_path, monkeypatch, caplog):
+        """Test that an unwritable cache location is warned about once, not fatal."""
+        monkeypatch.setattr("agent.config._cache_write_warned", False)
+        blocker = tmp_path / "not-a-dir"
+        blocker.write_text("")
+
+        config = Config.load_cached(temp_config_file, blocker / "config.json")
+        Config.load_cached(temp_config_file, blocker / "config.json")
+
+        assert config.mqtt.broker == "localhost"
+        warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+        assert len(warnings) == 1
+
+    def test_load_cached_missing_file(self, tmp_path):
+        """Test that a missing config file raises FileNotFoundError."""
+        with pytest.raises(FileNotFoundError):
+            Config.load_cached(tmp_path / "missing.yaml", tmp_path / "config.json")
+
     def test_get_user_exists(self, temp_config_file):
         """Test getting an existing user."""
         config = Config.load(temp_config_file)
@@ -63,6 +121,12 @@ class TestConfig:
 
         assert user is None
 
+    def test_get_user_direct_construction(self):
+        """Test user lookup on a Config built without load()."""
+        config = Config(users=[UserConfig(username="kid")])
+
+        assert config.get_user("kid") is config.users[0]
+
     def test_topic_prefix(self, temp_config_file):
         """Test topic prefix generation."""
         config = Config.load(temp_config_file)
@@ -99,3 +163,8 @@ class TestUserConfig:
         assert user.username == "kid"
         assert user.daily_minutes == 180
         assert user.warnings == [15, 10, 5, 1]
+
+    def test_invalid_warning_thresholds_dropped(self):
+        """Test that out-of-range or non-integer thresholds are ignored."""
+        user = UserConfig(username="kid", warnings=[120, -5, 0, 2000, "10", True, 5])
+        assert user.warnings == [120, 5]
@@ -0,0 +1,96 @@
+"""Tests for dns_blocker module."""
+
+from unittest.mock import MagicMock
+
+from agent.dns_blocker import (
+    DNSMASQ_CONFIG_PATH,
+    RELOAD_DNS_COMMANDS,
+    UPSTREAM_DNS,
+    DnsBlocker,
+)
+
+
+class TestDnsBlocker:
+    """Tests for DnsBlocker class."""
+
+    def test_generate_config(self):
+        """Test that whitelisted domains and defaults are forwarded."""
+        blocker = DnsBlocker(whitelist=["example.org"])
+        config = blocker._generate_config()
+
+        assert "address=/#/" in config
+        assert f"server=/example.org/{UPSTREAM_DNS}" in config
+        assert f"server=/.example.org/{UPSTREAM_DNS}" in config
+        assert f"server=/google.com/{UPSTREAM_DNS}" in config
+
+    def test_enable_applies_config_once(self, monkeypatch, mock_subprocess):
+        """Test that enabling writes the config and reloads via narrow sudo commands."""
+        monkeypatch.setattr("agent.dns_blocker.subprocess.run", mock_subprocess)
+        blocker = DnsBlocker()
+        blocker._is_root = False
+
+        blocker.set_enabled(True)
+        blocker.flush()
+
+        write, reload = mock_subprocess.call_args_list
+        assert write.args[0] == ["sudo", "/usr/bin/tee", DNSMASQ_CONFIG_PATH]
+        assert b"address=/#/" in write.kwargs["input"]
+        assert reload.args[0] == ["sudo", *RELOAD_DNS_COMMANDS[0]]
+
+    def test_reload_falls_back_to_restart(self, monkeypatch, mock_subprocess):
+        """Test that NetworkManager is restarted when the dns reload fails."""
+        mock_subprocess.side_effect = [
+            mock_subprocess.return_value,
+            MagicMock(returncode=1, stderr=b"unknown"),
+            mock_subprocess.return_value,
+        ]
+        monkeypatch.setattr("agent.dns_blocker.subprocess.run", mock_subprocess)
+        blocker = DnsBlocker()
+        blocker._is_root = False
+
+        blocker.set_enabled(True)
+        blocker.flush()
+
+        assert mock_subprocess.call_args.args[0] == ["sudo", *RELOAD_DNS_COMMANDS[1]]
+
+    def test_unchanged_whitelist_is_noop(self, monkeypatch, mock_subprocess):
+        """Test that re-sending the same whitelist does not touch dnsmasq."""
+        monkeypatch.setattr("agent.dns_blocker.subprocess.run", mock_subprocess)
+        blocker = DnsBlocker(enabled=True, whitelist=["example.org"])
+
+        blocker.update_whitelist([" Example.org "])
+        blocker.flush()
+
+        mock_subprocess.assert_not_called()
+
+    def test_burst_of_changes_is_coalesced(self, monkeypatch, mock_subprocess):
+        """Test that rapid updates result in a single apply of the final state."""
+        monkeypatch.setattr("agent.dns_blocker.subprocess.run", mock_subprocess)
+        blocker = DnsBlocker()
+        blocker._is_root = False
+
+        blocker.set_enabled(True)
+        blocker.update_whitelist(["a.com"])
+        blocker.update_whitelist(["b.com"])
+        blocker.flush()
+
+        assert mock_subprocess.call_count == 2
+        content = mock_subprocess.call_args_list[0].kwargs["input"]
+        assert b"server=/b.com/" in content
+        assert b"server=/a.com/" not in content
+
+    def test_enable_as_root_writes_directly(self, tmp_path, monkeypatch, mock_subprocess):
+        """Test that root writes the config file itself and only spawns the reload."""
+        config_path = tmp_path / "kidlock.conf"
+        monkeypatch.setattr("agent.dns_blocker.DNSMASQ_CONFIG_PATH", str(config_path))
+        monkeypatch.setattr("agent.dns_blocker.subprocess.run", mock_subprocess)
+        blocker = DnsBlocker()
+        blocker._is_root = True
+
+        blocker.set_enabled(True)
+        blocker.flush()
+
+        assert config_path.read_text() == blocker._generate_config()
+        assert list(tmp_path.iterdir()) == [config_path]
+        mock_subprocess.assert_called_once()
+        assert mock_subprocess.call_args.args[0] == RELOAD_DNS_COMMANDS[0]
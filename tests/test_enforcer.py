@@ -1,12 +1,24 @@
 """Tests for enforcer module."""
 
-from datetime import datetime
+import json
+import os
+import subprocess
+import threading
+import time
+from datetime import date, datetime
 from unittest.mock import patch
 
 import pytest
 
+from agent import fastjson
 from agent.config import ScheduleConfig, UserConfig
-from agent.enforcer import Enforcer, UserState
+from agent.enforcer import (
+    UTMP_RECORD,
+    UTMP_USER_PROCESS,
+    Enforcer,
+    UserState,
+    check_login_allowed,
+)
 
 
 class TestUserState:
@@ -35,7 +47,7 @@ class TestUserState:
 
         assert data["usage_minutes"] == 60
         assert data["paused"] is True
-        assert set(data["warnings_sent"]) == {10, 5}
+        assert data["warnings_sent"] == [5, 10]
 
     def test_from_dict(self):
         """Test deserialization from dict."""
@@ -60,6 +72,23 @@ class TestUserState:
         assert state.pending_request is not None
         assert state.pending_request["minutes"] == 15
 
+    def test_large_threshold_serializes(self):
+        """Test that thresholds of an hour or more stay encodable."""
+        state = UserState("testuser")
+        state.warnings_sent = {120, 60, 10}
+
+        data = fastjson.loads(fastjson.dumps(state.to_dict()))
+
+        assert data["warnings_sent"] == [10, 60, 120]
+        assert UserState.from_dict("testuser", data).warnings_sent == {120, 60, 10}
+
+    def test_no_instance_dict(self):
+        """Test that UserState uses slots rather than a per-instance dict."""
+        state = UserState("testuser")
+        assert not hasattr(state, "__dict__")
+        with pytest.raises(AttributeError):
+            state.typo_field = 1
+
 
 class TestEnforcer:
     """Tests for Enforcer class."""
@@ -190,7 +219,7 @@ class TestEnforcer:
         enforcer.mark_warning_sent("testuser", 10)
 
         state = enforcer.get_user_state("testuser")
-        assert 10 in state.warnings_sent
+        assert state.warnings_sent == {10}
 
         # Should not return already-sent warnings
         enforcer.add_usage("testuser", 115)
@@ -209,6 +238,27 @@ class TestEnforcer:
         assert state.block_reason == ""
 
 
+    def test_create_time_request(self, enforcer):
+        """Test that a time request gets a short hex id and is stored."""
+        request = enforcer.create_time_request("testuser", 30, "homework")
+
+        assert len(request["id"]) == 8
+        int(request["id"], 16)
+        assert enforcer.get_pending_request("testuser") == request
+
+    def test_today_is_cached_until_midnight(self, enforcer):
+        """Test that the date string is reused until the next local midnight."""
+        today = enforcer._today()
+        assert today == date.today().isoformat()
+        assert enforcer._today_expires > time.time()
+
+        enforcer._today_str = "stale"
+        assert enforcer._today() == "stale"
+
+        enforcer._today_expires = 0.0
+        assert enforcer._today() == today
+
+
 class TestScheduleEnforcement:
     """Tests for schedule-related enforcement."""
 
@@ -272,3 +322,269 @@ class TestScheduleEnforcement:
             # Should allow on parse error
             result = enforcer.is_within_schedule(schedule)
             assert result is True
+
+    @pytest.mark.parametrize(
+        "hour,minute,expected",
+        [(21, 0, False), (22, 0, True), (23, 59, True), (3, 0, True), (6, 0, True), (6, 1, False)],
+    )
+    def test_is_within_schedule_wraps_midnight(self, enforcer, hour, minute, expected):
+        """Test that a window ending before it starts spans midnight."""
+        schedule = ScheduleConfig(weekday="22:00-06:00", weekend="22:00-06:00")
+
+        with patch("agent.enforcer.datetime") as mock_dt:
+            mock_dt.now.return_value = datetime(2024, 1, 16, hour, minute)  # Tuesday
+
+            assert enforcer.is_within_schedule(schedule) is expected
+
+    def test_is_within_schedule_end_minute_inclusive(self, enforcer):
+        """Test that the whole end minute is allowed, so 23:59 covers the day."""
+        schedule = ScheduleConfig(weekday="00:00-23:59", weekend="00:00-23:59")
+
+        with patch("agent.enforcer.datetime") as mock_dt:
+            mock_dt.now.return_value = datetime(2024, 1, 15, 23, 59, 30)
+
+            assert enforcer.is_within_schedule(schedule) is True
+
+    def test_parse_schedule_is_cached(self, enforcer):
+        """Test that schedule strings are parsed once and reused."""
+        first = enforcer._parse_schedule("09:00-17:30")
+        assert first == (540, 1050)
+        assert enforcer._parse_schedule("09:00-17:30") is first
+
+    @pytest.mark.parametrize("schedule_str", ["25:00-26:00", "09:00", "9-17", "ab:cd-ef:gh"])
+    def test_parse_schedule_rejects_invalid(self, enforcer, schedule_str):
+        """Test that malformed schedules raise ValueError."""
+        with pytest.raises(ValueError):
+            enforcer._parse_schedule(schedule_str)
+
+
+class TestStatePersistence:
+    """Tests for coalesced state saving."""
+
+    @pytest.fixture
+    def enforcer(self, tmp_path, monkeypatch):
+        """Create an Enforcer with a temporary state directory."""
+        state_dir = tmp_path / "kidlock"
+        state_dir.mkdir()
+        state_file = state_dir / "state.json"
+
+        monkeypatch.setattr("agent.enforcer.STATE_DIR", state_dir)
+        monkeypatch.setattr("agent.enforcer.STATE_FILE", state_file)
+
+        return Enforcer()
+
+    def test_routine_changes_are_coalesced(self, enforcer):
+        """Test that routine updates are written once and flushed on demand."""
+        with patch.object(enforcer, "_save_state", wraps=enforcer._save_state) as save:
+            enforcer.add_usage("testuser", 1)
+            enforcer.add_usage("testuser", 1)
+            enforcer.mark_warning_sent("testuser", 10)
+            assert save.call_count == 1
+
+            enforcer.flush()
+            assert save.call_count == 2
+
+            enforcer.flush()  # Nothing pending
+            assert save.call_count == 2
+
+    def test_saves_are_serialized(self, enforcer, tmp_path):
+        """Test that concurrent saves never interleave on the temp file."""
+        held = []
+        real_replace = os.replace
+
+        def replace(src, dst):
+            held.append(enforcer._save_lock.locked())
+            real_replace(src, dst)
+
+        def save_many(username):
+            for minutes in range(20):
+                enforcer.add_usage(username, minutes)
+                enforcer._save_state()
+
+        with patch("agent.enforcer.os.replace", side_effect=replace):
+            threads = [threading.Thread(target=save_many, args=(name,)) for name in ("a", "b")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert held and all(held)
+        data = json.loads((tmp_path / "kidlock" / "state.json").read_text())
+        assert set(data["users"]) == {"a", "b"}
+        assert not (tmp_path / "kidlock" / "state.json.tmp").exists()
+
+    def test_large_warning_threshold_is_saved(self, enforcer, tmp_path):
+        """Test that a 120-minute warning does not break state saving."""
+        enforcer.mark_warning_sent("testuser", 120)
+        enforcer.flush()
+
+        data = fastjson.loads((tmp_path / "kidlock" / "state.json").read_bytes())
+        assert data["users"]["testuser"]["warnings_sent"] == [120]
+
+    def test_blocking_changes_are_written_immediately(self, enforcer):
+        """Test that force_logout persists the block for the PAM check."""
+        enforcer.add_usage("testuser", 1)
+
+        with patch("agent.enforcer.subprocess.run") as run:
+            run.return_value.returncode = 0
+            enforcer.force_logout("testuser", "Daily time limit reached")
+
+        assert enforcer._dirty is False
+
+    def test_force_logout_falls_back_to_pkill(self, enforcer):
+        """Test that pkill is used when loginctl fails, discarding output."""
+        with patch("agent.enforcer.subprocess.run") as run:
+            run.return_value.returncode = 1
+            assert enforcer.force_logout("testuser", "Outside allowed hours") is False
+
+        assert run.call_count == 2
+        assert run.call_args_list[0].args[0][0].endswith("loginctl")
+        assert run.call_args_list[1].args[0][0].endswith("pkill")
+        assert run.call_args.kwargs["stdout"] is subprocess.DEVNULL
+
+    def test_unblock_noop_when_not_blocked(self, enforcer):
+        """Test that unblocking an unblocked user does not write state."""
+        with patch.object(enforcer, "_save_state") as save:
+            enforcer.unblock_user("testuser")
+            save.assert_not_called()
+
+    def test_save_replaces_state_file_atomically(self, enforcer, tmp_path):
+        """Test that saving leaves only a complete state file behind."""
+        enforcer.add_usage("testuser", 5)
+        enforcer.flush()
+
+        state_dir = tmp_path / "kidlock"
+        assert [p.name for p in state_dir.iterdir()] == ["state.json"]
+        assert Enforcer().get_usage_minutes("testuser") == 5
+
+    def test_identical_state_is_not_rewritten(self, enforcer, tmp_path):
+        """Test that a save producing the same bytes skips the disk write."""
+        enforcer.set_paused("testuser", True)
+        enforcer.set_paused("testuser", False)
+        enforcer.flush()
+        state_file = tmp_path / "kidlock" / "state.json"
+        mtime = state_file.stat().st_mtime_ns
+
+        enforcer.set_paused("testuser", True)
+        enforcer.set_paused("testuser", False)
+        with patch("agent.enforcer.os.replace") as replace:
+            enforcer.flush()
+            replace.assert_not_called()
+        assert state_file.stat().st_mtime_ns == mtime
+
+    def test_externally_changed_state_is_rewritten(self, enforcer, tmp_path):
+        """Test that an unchanged payload is still written after another writer."""
+        enforcer.add_usage("testuser", 5)
+        enforcer.flush()
+        state_file = tmp_path / "kidlock" / "state.json"
+        state_file.write_text(json.dumps({"schedule_overrides": {}}))
+
+        enforcer.set_paused("testuser", True)
+        enforcer.set_paused("testuser", False)
+        enforcer.flush()
+        assert json.loads(state_file.read_text())["users"]["testuser"]["usage_minutes"] == 5
+
+        state_file.unlink()
+        enforcer.set_paused("testuser", True)
+        enforcer.set_paused("testuser", False)
+        enforcer.flush()
+        assert state_file.exists()
+
+    def test_saved_format_omits_runtime_fields(self, enforcer, tmp_path):
+        """Test that only persisted UserState fields are written."""
+        enforcer.set_idle("testuser", True)
+        enforcer.mark_warning_sent("testuser", 10)
+        enforcer.flush()
+
+        data = json.loads((tmp_path / "kidlock" / "state.json").read_text())
+        user = data["users"]["testuser"]
+        assert user["warnings_sent"] == [10]
+        assert "is_idle" not in user
+        assert "username" not in user
+
+
+class TestLoggedInUsers:
+    """Tests for logged-in user detection."""
+
+    @pytest.fixture
+    def utmp_path(self, tmp_path):
+        path = tmp_path / "utmp"
+        with patch("agent.enforcer.UTMP_PATH", path):
+            yield path
+
+    @pytest.fixture
+    def enforcer(self, temp_state_file, utmp_path):
+        with patch("agent.enforcer.STATE_FILE", temp_state_file):
+            with patch("agent.enforcer.STATE_DIR", temp_state_file.parent):
+                yield Enforcer()
+
+    @staticmethod
+    def _utmp_record(ut_type, user):
+        return UTMP_RECORD.pack(
+            ut_type, 1234, b"tty2", b"tty2", user, b"",
+            0, 0, 0, 0, 0, 0, 0, 0, 0, b"",
+        )
+
+    def test_utmp_is_parsed(self, enforcer, utmp_path, mock_subprocess):
+        """Test that user sessions are read from utmp without running `who`."""
+        utmp_path.write_bytes(
+            self._utmp_record(2, b"reboot")
+            + self._utmp_record(UTMP_USER_PROCESS, b"alice")
+            + self._utmp_record(UTMP_USER_PROCESS, b"bob")
+            + self._utmp_record(8, b"carol")
+        )
+        with patch("agent.enforcer.subprocess.run", mock_subprocess):
+            assert enforcer.get_logged_in_users() == {"alice", "bob"}
+        mock_subprocess.assert_not_called()
+
+    def test_malformed_utmp_falls_back_to_who(self, enforcer, utmp_path, mock_subprocess):
+        """Test that an unexpected utmp layout falls back to `who`."""
+        utmp_path.write_bytes(b"\0" * 100)
+        mock_subprocess.return_value.stdout = "alice    tty2\n"
+        with patch("agent.enforcer.subprocess.run", mock_subprocess):
+            assert enforcer.get_logged_in_users() == {"alice"}
+
+    def test_who_output_is_parsed(self, enforcer, mock_subprocess):
+        """Test that user names are taken from the first column of `who`."""
+        mock_subprocess.return_value.stdout = (
+            "alice    tty2         2024-01-15 09:00 (tty2)\n"
+            "bob      pts/0        2024-01-15 09:05 (:0)\n"
+        )
+        with patch("agent.enforcer.subprocess.run", mock_subprocess):
+            assert enforcer.get_logged_in_users() == {"alice", "bob"}
+
+    def test_result_is_cached_briefly(self, enforcer, mock_subprocess):
+        """Test that `who` runs once per cache interval."""
+        now = [1000.0]
+        mock_subprocess.return_value.stdout = "alice    tty2\n"
+        with patch("agent.enforcer.subprocess.run", mock_subprocess), \
+                patch("agent.enforcer.time.monotonic", lambda: now[0]):
+            enforcer.get_logged_in_users()
+            enforcer.get_status("alice", 120)
+            assert mock_subprocess.call_count == 1
+
+            now[0] += 1.5
+            enforcer.get_logged_in_users()
+            assert mock_subprocess.call_count == 2
+
+
+class TestCheckLoginAllowed:
+    """Tests for the PAM login check."""
+
+    @pytest.fixture
+    def state_file(self, tmp_path, monkeypatch):
+        path = tmp_path / "state.json"
+        monkeypatch.setattr("agent.enforcer.STATE_FILE", path)
+        return path
+
+    def test_missing_state_allows(self, state_file):
+        """Test that login is allowed without a state file."""
+        assert check_login_allowed("testuser") == (True, "")
+
+    def test_blocked_user_denied(self, state_file):
+        """Test that a blocked user is denied with the block reason."""
+        state_file.write_text(json.dumps({
+            "users": {"testuser": {"blocked": True, "block_reason": "Daily time limit reached"}}
+        }))
+        assert check_login_allowed("testuser") == (False, "Daily time limit reached")
+        assert check_login_allowed("otheruser") == (True, "")
@@ -0,0 +1,55 @@
+"""Tests for fastjson module."""
+
+import json
+from dataclasses import dataclass
+
+import pytest
+
+from agent import fastjson
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def backend(request, monkeypatch):
+    """Run each test with orjson (if installed) and the stdlib fallback."""
+    if request.param == "stdlib":
+        monkeypatch.setattr(fastjson, "orjson", None)
+    elif fastjson.orjson is None:
+        pytest.skip("orjson not installed")
+    return request.param
+
+
+class TestFastJson:
+    """Tests for the JSON helpers."""
+
+    def test_dumps_compact_bytes(self, backend):
+        """Test that dumps returns compact UTF-8 bytes."""
+        payload = fastjson.dumps({"user": "josé", "minutes": [10, 5]})
+
+        assert isinstance(payload, bytes)
+        assert b" " not in payload
+        assert json.loads(payload) == {"user": "josé", "minutes": [10, 5]}
+
+    def test_dumps_pretty(self, backend):
+        """Test that pretty output is indented."""
+        assert fastjson.dumps({"a": 1}, pretty=True) == b'{\n  "a": 1\n}'
+
+    def test_loads_bytes_and_str(self, backend):
+        """Test that loads accepts both bytes and str."""
+        assert fastjson.loads(b'{"a": 1}') == {"a": 1}
+        assert fastjson.loads('{"a": 1}') == {"a": 1}
+
+    def test_decode_error(self, backend):
+        """Test that invalid input raises JSONDecodeError."""
+        with pytest.raises(fastjson.JSONDecodeError):
+            fastjson.loads(b"{not json")
+
+    def test_dumps_default_handles_dataclasses(self, backend):
+        """Test that dataclasses are encoded through the default hook."""
+
+        @dataclass
+        class Point:
+            x: int
+            y: int
+
+        payload = fastjson.dumps({"p": Point(1, 2)}, default=lambda p: [p.x, p.y])
+        assert json.loads(payload) == {"p": [1, 2]}
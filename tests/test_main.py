@@ -0,0 +1,305 @@
+"""Tests for main module."""
+
+import json
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from agent.config import Config, UserConfig
+from agent.main import STALE_CLAIM_SECONDS, KidlockAgent
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    """Create a KidlockAgent with all components mocked out."""
+    monkeypatch.setattr("agent.main.REQUEST_DIR", tmp_path / "requests")
+    config = Config(users=[UserConfig(username="kid")])
+    components = ["Enforcer", "DnsBlocker", "MqttClient", "Notifier",
+                  "TamperDetector", "LinuxPlatform", "AppTracker"]
+    patches = [patch(f"agent.main.{name}") for name in components]
+    for p in patches:
+        p.start()
+    try:
+        yield KidlockAgent(config)
+    finally:
+        for p in patches:
+            p.stop()
+
+
+class TestCommands:
+    """Tests for MQTT command handling."""
+
+    def test_command_targets_named_user_or_all(self, agent):
+        """Test that commands without a user apply to every controlled user."""
+        agent.config.users.append(UserConfig(username="sibling"))
+
+        agent._on_command({"action": "pause"})
+        agent._on_command({"action": "resume", "user": "kid"})
+
+        calls = [c.args for c in agent.enforcer.set_paused.call_args_list]
+        assert calls == [("kid", True), ("sibling", True), ("kid", False)]
+
+    def test_lock_ignores_unknown_user(self, agent):
+        """Test that lock only logs out controlled users."""
+        agent._on_command({"action": "lock", "user": "parent"})
+
+        agent.enforcer.force_logout.assert_not_called()
+
+
+class TestLoginEvents:
+    """Tests for login/logout event detection."""
+
+    def test_login_and_logout_events(self, agent):
+        """Test that events fire only for controlled users whose state changed."""
+        agent.enforcer.check_user.return_value = (True, "")
+        agent.enforcer.is_paused.return_value = False
+
+        agent._check_and_enforce({"kid", "parent"})
+        agent._check_and_enforce({"kid", "parent"})
+        agent._check_and_enforce(set())
+
+        events = [c.args[:2] for c in agent.mqtt_client.publish_event.call_args_list]
+        assert events == [("login", "kid"), ("logout", "kid")]
+
+
+class TestWarnings:
+    """Tests for time warning checks."""
+
+    def test_warnings_skipped_while_time_remains(self, agent):
+        """Test that the warning scan is skipped above the largest threshold."""
+        user_config = agent.config.users[0]
+        user_config.daily_minutes = 120
+        agent.enforcer.get_time_remaining.return_value = max(user_config.warnings) + 1
+
+        agent._check_and_send_warnings(user_config)
+
+        agent.enforcer.get_warnings_to_send.assert_not_called()
+
+    def test_due_warning_is_sent(self, agent):
+        """Test that a due warning is sent and marked."""
+        user_config = agent.config.users[0]
+        user_config.daily_minutes = 120
+        agent.enforcer.get_time_remaining.return_value = 5
+        agent.enforcer.get_warnings_to_send.return_value = [5]
+        agent.notifier.send_time_warning.return_value = True
+
+        agent._check_and_send_warnings(user_config)
+
+        agent.notifier.send_time_warning.assert_called_once_with("kid", 5)
+        agent.enforcer.mark_warning_sent.assert_called_once_with("kid", 5)
+
+
+class TestAccountUsage:
+    """Tests for usage accounting."""
+
+    def test_idle_users_are_not_charged(self, agent):
+        """Test that idle or locked users are skipped, checked concurrently."""
+        agent.config.users = [UserConfig(username=name) for name in ("kid", "teen", "tot")]
+        agent.config.activity.idle_threshold_minutes = 5
+        agent.enforcer.is_paused.return_value = False
+        agent.platform.is_session_locked.side_effect = lambda user: user == "tot"
+        agent.platform.get_user_idle_seconds.side_effect = lambda user: 600 if user == "teen" else 0
+        agent._last_check -= 120
+
+        agent._account_usage({"kid", "teen", "tot"})
+
+        agent.enforcer.add_usage.assert_called_once_with("kid", 2)
+        idle = {c.args[0]: c.args[1] for c in agent.enforcer.set_idle.call_args_list}
+        assert idle == {"kid": False, "teen": True, "tot": True}
+
+    def test_short_passes_accumulate(self, agent, monkeypatch):
+        """Test that passes shorter than a minute still add up to usage."""
+        now = [1000.0]
+        monkeypatch.setattr("agent.main.time.monotonic", lambda: now[0])
+        agent.config.activity.idle_threshold_minutes = 5
+        agent.enforcer.is_paused.return_value = False
+        agent.platform.is_session_locked.return_value = False
+        agent.platform.get_user_idle_seconds.return_value = 0
+        agent._last_check = now[0]
+
+        for _ in range(7):
+            now[0] += 10
+            agent._account_usage({"kid"})
+
+        # Charged once at the 60 s mark, with 10 s carried forward
+        agent.enforcer.add_usage.assert_called_once_with("kid", 1)
+        assert agent.platform.get_user_idle_seconds.call_count == 1
+        assert agent._usage_seconds["kid"] == pytest.approx(10)
+
+    def test_logout_drops_partial_minute(self, agent):
+        """Test that unbilled seconds are discarded when the user leaves."""
+        agent.enforcer.is_paused.return_value = False
+        agent._usage_seconds["kid"] = 45
+
+        agent._account_usage(set())
+
+        assert "kid" not in agent._usage_seconds
+
+
+class TestFileRequests:
+    """Tests for file-based time requests."""
+
+    @pytest.fixture
+    def request_dir(self, tmp_path):
+        path = tmp_path / "requests"
+        path.mkdir()
+        return path
+
+    def test_request_file_is_processed_and_removed(self, agent, request_dir):
+        """Test that a request file creates a time request."""
+        agent.enforcer.has_pending_request.return_value = False
+        agent.enforcer.create_time_request.return_value = {"id": "abcd1234"}
+        request_file = request_dir / "kid.json"
+        request_file.write_text(json.dumps({"username": "kid", "minutes": 30, "reason": "homework"}))
+
+        agent._check_file_requests()
+
+        agent.enforcer.create_time_request.assert_called_once_with("kid", 30, "homework")
+        assert not request_file.exists()
+
+    def test_invalid_request_file_is_removed(self, agent, request_dir):
+        """Test that unparseable request files are discarded."""
+        request_file = request_dir / "kid.json"
+        request_file.write_text("{not json")
+
+        agent._check_file_requests()
+
+        agent.enforcer.create_time_request.assert_not_called()
+        assert not request_file.exists()
+
+    def test_symlink_and_oversized_files_are_rejected(self, agent, request_dir, tmp_path):
+        """Test that symlinks and large files are removed without being parsed."""
+        target = tmp_path / "target.json"
+        target.write_text(json.dumps({"username": "kid"}))
+        (request_dir / "kid.json").symlink_to(target)
+        big = request_dir / "big.json"
+        big.write_text(json.dumps({"username": "kid", "reason": "x" * 8192}))
+
+        agent._check_file_requests()
+
+        agent.enforcer.create_time_request.assert_not_called()
+        assert list(request_dir.iterdir()) == []
+        assert target.exists()
+
+    def test_dangling_symlink_is_removed(self, agent, request_dir):
+        """Test that a symlink to a missing target does not abort the scan."""
+        (request_dir / "kid.json").symlink_to("/nonexistent")
+
+        agent._check_file_requests()
+
+        agent.enforcer.create_time_request.assert_not_called()
+        assert list(request_dir.iterdir()) == []
+
+    def test_entry_vanishing_during_scan_is_skipped(self, agent, request_dir):
+        """Test that a file claimed between listing and stat() is skipped."""
+        (request_dir / "kid.json").write_text(json.dumps({"username": "kid"}))
+
+        with patch("os.DirEntry.stat", side_effect=FileNotFoundError), \
+                patch.object(agent, "_process_request_file") as process:
+            agent._check_file_requests()
+
+        process.assert_not_called()
+
+    def test_claim_removed_when_processing_fails(self, agent, request_dir):
+        """Test that a failing request does not leave its claimed file behind."""
+        (request_dir / "kid.json").write_text(json.dumps({"username": "kid"}))
+        agent.enforcer.create_time_request.side_effect = RuntimeError("boom")
+
+        agent._check_file_requests()
+
+        assert list(request_dir.iterdir()) == []
+
+    def test_stale_claim_is_swept(self, agent, request_dir, monkeypatch):
+        """Test that a claimed file left by a dead agent is removed once stale."""
+        claimed = request_dir / "kid.json.4242.taken"
+        claimed.write_text("{}")
+
+        agent._check_file_requests()
+        assert claimed.exists()
+
+        now = time.time() + STALE_CLAIM_SECONDS
+        monkeypatch.setattr("agent.main.time.time", lambda: now)
+        agent._check_file_requests()
+        assert not claimed.exists()
+
+    def test_file_claimed_elsewhere_is_skipped(self, agent, request_dir):
+        """Test that a file renamed away by another agent is not processed."""
+        agent._process_request_file(str(request_dir / "kid.json"))
+
+        agent.enforcer.create_time_request.assert_not_called()
+
+    def test_unchanged_directory_is_not_listed(self, agent, request_dir):
+        """Test that the directory is only scanned again after it changes."""
+        agent._check_file_requests()
+
+        with patch.object(agent, "_process_request_file") as process:
+            agent._check_file_requests()
+            process.assert_not_called()
+
+            (request_dir / "kid.json").write_text("{}")
+            agent._check_file_requests()
+            process.assert_called_once()
+
+    def test_empty_and_other_files_are_left_alone(self, agent, request_dir):
+        """Test that half-written and non-JSON files are not processed."""
+        (request_dir / "kid.json").write_text("")
+        (request_dir / "notes.txt").write_text("{}")
+
+        with patch.object(agent, "_process_request_file") as process:
+            agent._check_file_requests()
+            process.assert_not_called()
+
+            # Still pending, so the next pass looks again
+            (request_dir / "kid.json").write_text("{}")
+            agent._check_file_requests()
+            process.assert_called_once_with(str(request_dir / "kid.json"))
+
+    def test_stale_empty_file_is_removed(self, agent, request_dir):
+        """Test that an abandoned empty file is deleted and stops the rescans."""
+        stale = request_dir / "kid.json"
+        stale.write_text("")
+        old = time.time() - 60
+        os.utime(stale, (old, old))
+
+        agent._check_file_requests()
+        assert not stale.exists()
+
+        agent._check_file_requests()
+        with patch("agent.main.os.scandir") as scandir:
+            agent._check_file_requests()
+            scandir.assert_not_called()
+
+    def test_missing_directory_is_ignored(self, agent):
+        """Test that a missing request directory is not an error."""
+        agent._check_file_requests()
+
+
+class TestRunLoop:
+    """Tests for the agent main loop."""
+
+    def test_stop_wakes_the_loop(self, agent):
+        """Test that request_stop() interrupts the wait and run() tears down once."""
+        agent.mqtt_client.wait_for_connection.return_value = True
+        agent.tamper_detector.check.return_value = (False, "")
+        agent.config.activity.poll_interval = 3600
+
+        with patch.object(agent, "_check_and_enforce", side_effect=lambda logged_in: agent.request_stop()), \
+                patch("agent.main.os.chmod"), patch.object(agent, "_load_schedule_overrides"):
+            agent.run()
+
+        assert agent._stop_event.is_set()
+        agent.mqtt_client.disconnect.assert_called_once()
+
+    def test_stop_during_startup_is_kept(self, agent):
+        """Test that a stop requested before the loop starts skips every pass."""
+        agent.mqtt_client.wait_for_connection.return_value = True
+        agent.mqtt_client.publish_ha_discovery.side_effect = lambda users: agent.request_stop()
+
+        with patch.object(agent, "_check_and_enforce") as check, \
+                patch("agent.main.os.chmod"), patch.object(agent, "_load_schedule_overrides"):
+            agent.run()
+
+        check.assert_not_called()
+        agent.mqtt_client.disconnect.assert_called_once()
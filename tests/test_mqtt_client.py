@@ -0,0 +1,199 @@
+"""Tests for mqtt_client module."""
+
+import json
+import threading
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from agent.config import Config, UserConfig
+from agent.mqtt_client import MAX_INFLIGHT_MESSAGES, USER_STATE_HEARTBEAT, MqttClient, _now_iso
+
+
+@pytest.fixture
+def client():
+    """Create an MqttClient with a mocked paho client."""
+    mqtt_client = MqttClient(Config(), on_command=MagicMock())
+    mqtt_client._client = MagicMock()
+    return mqtt_client
+
+
+class TestBatch:
+    """Tests for batched publishing."""
+
+    def test_publishes_deferred_until_exit(self, client):
+        """Test that publishes inside a batch are sent in order on exit."""
+        with client.batch():
+            client.publish_event("login", "kid")
+            client.publish_status("online")
+            client._client.publish.assert_not_called()
+
+        topics = [c.args[0] for c in client._client.publish.call_args_list]
+        assert topics == [client.topic_event, client.topic_status]
+
+    def test_nested_batch_joins_outer(self, client):
+        """Test that an inner batch does not flush early."""
+        with client.batch():
+            with client.batch():
+                client.publish_status("online")
+            client._client.publish.assert_not_called()
+
+        assert client._client.publish.call_count == 1
+
+    def test_other_threads_publish_immediately(self, client):
+        """Test that a batch only defers publishes from its own thread."""
+        with client.batch():
+            thread = threading.Thread(target=client.publish_status, args=("online",))
+            thread.start()
+            thread.join()
+            assert client._client.publish.call_count == 1
+
+    def test_flushes_on_error(self, client):
+        """Test that queued messages are still sent if the block raises."""
+        with pytest.raises(RuntimeError), client.batch():
+            client.publish_status("online")
+            raise RuntimeError
+
+        assert client._client.publish.call_count == 1
+
+    def test_discovery_is_batched(self, client):
+        """Test that discovery messages are queued and sent together."""
+        sent = []
+        client._client.publish.side_effect = lambda topic, *a, **kw: sent.append(
+            client._local.pending
+        )
+        client.publish_ha_discovery([UserConfig(username="kid")])
+
+        assert len(sent) > 2
+        assert all(pending is None for pending in sent)
+        assert all(c.kwargs["retain"] for c in client._client.publish.call_args_list)
+
+
+class TestDiscovery:
+    """Tests for Home Assistant discovery messages."""
+
+    def test_command_payloads_match_json_encoding(self, client):
+        """Test that pre-formatted button payloads equal the encoded commands."""
+        client.publish_ha_discovery([UserConfig(username='k"id')])
+
+        configs = {
+            c.args[0].split("/")[-2]: json.loads(c.args[1])
+            for c in client._client.publish.call_args_list
+        }
+        hostname = client.config.device.hostname
+        user_id = f'{hostname}_k"id'
+        assert json.loads(configs[f"{user_id}_lock"]["payload_press"]) == {"action": "lock", "user": 'k"id'}
+        assert configs[f"{user_id}_add_15min"]["payload_press"] == json.dumps(
+            {"action": "add_time", "user": 'k"id', "minutes": 15}
+        )
+        assert configs[f"{user_id}_paused"]["payload_off"] == json.dumps({"action": "resume", "user": 'k"id'})
+
+
+class TestConnect:
+    """Tests for client setup."""
+
+    def test_inflight_window_raised(self, monkeypatch):
+        """Test that the QoS 1 inflight window fits a full discovery burst."""
+        paho_client = MagicMock()
+        monkeypatch.setattr("agent.mqtt_client.mqtt.Client", lambda *a, **kw: paho_client)
+
+        MqttClient(Config(), on_command=MagicMock()).connect()
+
+        paho_client.max_inflight_messages_set.assert_called_once_with(MAX_INFLIGHT_MESSAGES)
+        paho_client.loop_start.assert_called_once()
+
+
+class TestTopics:
+    """Tests for topic helpers."""
+
+    def test_fixed_topics_use_device_prefix(self, client):
+        """Test that the fixed topics are built from the device prefix."""
+        prefix = client.config.topic_prefix
+
+        assert client.topic_status == f"{prefix}/status"
+        assert client.topic_command == f"{prefix}/command"
+        assert client.topic_tamper == f"{prefix}/tamper"
+
+    def test_user_topic_is_cached(self, client):
+        """Test that per-user topics are built once and reused."""
+        topic = client.topic_user("kid")
+
+        assert topic == f"{client.config.topic_prefix}/user/kid"
+        assert client.topic_user("kid") is topic
+
+    def test_user_activity_published_to_user_topic(self, client):
+        """Test that user activity goes to the cached user topic."""
+        client.publish_user_activity("kid", True, 30, False, "", 120)
+
+        assert client._client.publish.call_args.args[0] == client.topic_user("kid")
+
+
+class TestUserActivity:
+    """Tests for per-user state publishing."""
+
+    def test_unchanged_state_is_skipped(self, client, monkeypatch):
+        """Test that identical state is only re-sent, unretained, after the heartbeat."""
+        now = [1000.0]
+        monkeypatch.setattr("agent.mqtt_client.time.monotonic", lambda: now[0])
+
+        client.publish_user_activity("kid", True, 30, False, "", 120)
+        client.publish_user_activity("kid", True, 30, False, "", 120)
+        assert client._client.publish.call_count == 1
+
+        client.publish_user_activity("kid", True, 31, False, "", 120)
+        assert client._client.publish.call_count == 2
+
+        now[0] += USER_STATE_HEARTBEAT
+        client.publish_user_activity("kid", True, 31, False, "", 120)
+        assert client._client.publish.call_count == 3
+
+        retained = [c.kwargs["retain"] for c in client._client.publish.call_args_list]
+        assert retained == [True, True, False]
+
+    def test_reconnect_resends_state(self, client):
+        """Test that a new connection clears the last published state."""
+        client.publish_user_activity("kid", True, 30, False, "", 120)
+        client._on_connect(client._client, None, {}, 0)
+        client._client.publish.reset_mock()
+
+        client.publish_user_activity("kid", True, 30, False, "", 120)
+        assert client._client.publish.call_count == 1
+
+
+class TestTimestamps:
+    """Tests for event timestamps."""
+
+    def test_timestamp_formatted_once_per_second(self, monkeypatch):
+        """Test that the ISO timestamp is reused within the same second."""
+        now = [1_700_000_000.2]
+        monkeypatch.setattr("agent.mqtt_client.time.time", lambda: now[0])
+        monkeypatch.setattr("agent.mqtt_client._iso_cache", (0, ""))
+
+        first = _now_iso()
+        now[0] += 0.5
+        assert _now_iso() is first
+
+        now[0] += 1
+        assert _now_iso() != first
+        assert datetime.fromisoformat(first) == datetime.fromtimestamp(1_700_000_000)
+
+
+class TestOnMessage:
+    """Tests for incoming message handling."""
+
+    def test_command_is_decoded_from_bytes(self, client):
+        """Test that command payloads are parsed straight from bytes."""
+        msg = MagicMock(topic=client.topic_command, payload=b'{"action": "lock", "user": "kid"}')
+
+        client._on_message(client._client, None, msg)
+
+        client.on_command.assert_called_once_with({"action": "lock", "user": "kid"})
+
+    def test_invalid_json_is_ignored(self, client):
+        """Test that malformed payloads are logged and dropped."""
+        msg = MagicMock(topic=client.topic_command, payload=b"\xff{not json")
+
+        client._on_message(client._client, None, msg)
+
+        client.on_command.assert_not_called()
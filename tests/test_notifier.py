@@ -0,0 +1,91 @@
+"""Tests for notifier module."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from agent.notifier import USER_ENV_CACHE_SECONDS, Notifier
+
+
+@pytest.fixture(autouse=True)
+def clear_env_cache():
+    Notifier._user_env_cache.clear()
+    yield
+    Notifier._user_env_cache.clear()
+
+
+class TestUserEnv:
+    """Tests for per-user notification environment lookup."""
+
+    def test_env_cached_while_session_found(self, monkeypatch):
+        """Test that DISPLAY and uid are looked up once per cache period."""
+        now = [1000.0]
+        monkeypatch.setattr("agent.notifier.time.monotonic", lambda: now[0])
+        with patch.object(Notifier, "_get_user_display", return_value=":1") as display, \
+                patch("agent.notifier._get_uid", return_value=1001):
+            assert Notifier._get_user_env("kid") == (":1", 1001)
+            assert Notifier._get_user_env("kid") == (":1", 1001)
+            assert display.call_count == 1
+
+            now[0] += USER_ENV_CACHE_SECONDS
+            Notifier._get_user_env("kid")
+            assert display.call_count == 2
+
+    def test_fallback_display_not_cached(self):
+        """Test that the ':0' fallback is retried on the next notification."""
+        with patch.object(Notifier, "_get_user_display", return_value=None) as display, \
+                patch("agent.notifier._get_uid", return_value=1001):
+            assert Notifier._get_user_env("kid") == (":0", 1001)
+            Notifier._get_user_env("kid")
+            assert display.call_count == 2
+
+
+class TestUserDisplay:
+    """Tests for DISPLAY lookup via the shared loginctl session query."""
+
+    def test_display_from_graphical_session(self):
+        """Test that the user's session with a display is used."""
+        listing = MagicMock(stdout="3 1000 parent seat0\n5 1001 kid\n7 1001 kid seat0\n")
+        shown = MagicMock(stdout="Id=3\nDisplay=:0\n\nId=5\nDisplay=\n\nId=7\nDisplay=:1\n")
+        with patch("agent.platform.linux.subprocess.run", side_effect=[listing, shown]) as run:
+            assert Notifier._get_user_display("kid") == ":1"
+
+        assert run.call_count == 2
+
+    def test_no_session(self):
+        """Test that users without a session have no display."""
+        listing = MagicMock(stdout="3 1000 parent seat0\n")
+        shown = MagicMock(stdout="Id=3\nDisplay=:0\n")
+        with patch("agent.platform.linux.subprocess.run", side_effect=[listing, shown]):
+            assert Notifier._get_user_display("kid") is None
+
+    def test_loginctl_failure_has_no_display(self):
+        """Test that a failing loginctl call is treated as no session."""
+        with patch("agent.platform.linux.subprocess.run", side_effect=PermissionError("denied")):
+            assert Notifier._get_user_display("kid") is None
+
+
+class TestSendNotification:
+    """Tests for notify-send invocation."""
+
+    def test_runs_notify_send_as_user_with_session_bus(self):
+        """Test that notify-send runs via sudo with the user's bus address."""
+        with patch.object(Notifier, "_get_user_env", return_value=(":1", 1001)), \
+                patch("agent.notifier.os.geteuid", return_value=0), \
+                patch("agent.notifier.subprocess.run", return_value=MagicMock(returncode=0)) as run:
+            assert Notifier.send_notification("kid", "Title", "Body")
+
+        run.assert_called_once()
+        cmd = run.call_args.args[0]
+        env = run.call_args.kwargs["env"]
+        assert cmd[:4] == ["sudo", "-u", "kid", "notify-send"]
+        assert env["DISPLAY"] == ":1"
+        assert env["DBUS_SESSION_BUS_ADDRESS"] == "unix:path=/run/user/1001/bus"
+
+    def test_env_lookup_failure_is_not_raised(self):
+        """Test that an error looking up the user's session fails the send only."""
+        with patch.object(Notifier, "_get_user_env", side_effect=OSError("boom")), \
+                patch("agent.notifier.subprocess.run") as run:
+            assert not Notifier.send_notification("kid", "Title", "Body")
+
+        run.assert_not_called()
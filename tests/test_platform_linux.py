@@ -0,0 +1,75 @@
+"""Tests for the Linux platform implementation."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from agent.platform.linux import LinuxPlatform
+
+LIST_SESSIONS = """\
+    3 1001 alice seat0 tty2
+    7 1002 bob   -     pts/1
+    9 1001 alice -     pts/0
+"""
+
+SHOW_SESSION = """\
+Id=3
+Display=:0
+LockedHint=yes
+
+Id=7
+Display=
+LockedHint=no
+"""
+
+
+def _loginctl(args, **kwargs):
+    result = MagicMock(returncode=0)
+    result.stdout = LIST_SESSIONS if args[1] == "list-sessions" else SHOW_SESSION
+    return result
+
+
+class TestSessions:
+    """Tests for loginctl session lookups."""
+
+    @pytest.fixture
+    def platform(self):
+        return LinuxPlatform()
+
+    def test_sessions_are_parsed(self, platform):
+        """Test that display and lock state come from one show-session call."""
+        with patch("agent.platform.linux.subprocess.run", side_effect=_loginctl) as run:
+            assert platform._get_user_display("alice") == ":0"
+            assert platform.is_session_locked("alice") is True
+            assert platform._get_user_display("bob") is None
+            assert platform.is_session_locked("bob") is False
+            assert platform.is_session_locked("carol") is False
+
+        assert run.call_count == 2
+        assert run.call_args.args[0][2:5] == ["3", "7", "9"]
+
+    def test_graphical_session_preferred(self, platform):
+        """Test that a later session with a display wins over one without."""
+        listing = MagicMock(stdout="4 1001 alice - pts/0\n3 1001 alice seat0 tty2\n")
+        shown = MagicMock(stdout="Id=4\nDisplay=\nLockedHint=no\n\nId=3\nDisplay=:0\nLockedHint=no\n")
+        with patch("agent.platform.linux.subprocess.run", side_effect=[listing, shown]):
+            assert platform._get_user_display("alice") == ":0"
+
+    def test_snapshot_is_refreshed_after_interval(self, platform):
+        """Test that loginctl is queried again once the snapshot expires."""
+        now = [1000.0]
+        with patch("agent.platform.linux.subprocess.run", side_effect=_loginctl) as run, \
+                patch("agent.platform.linux.time.monotonic", lambda: now[0]):
+            platform.is_session_locked("alice")
+            now[0] += 2
+            platform.is_session_locked("alice")
+
+        assert run.call_count == 4
+
+    def test_no_sessions(self, platform, mock_subprocess):
+        """Test that show-session is skipped when nobody is logged in."""
+        with patch("agent.platform.linux.subprocess.run", mock_subprocess):
+            assert platform.is_session_locked("alice") is False
+            assert platform.get_user_idle_seconds("alice") == 0
+
+        mock_subprocess.assert_called_once()
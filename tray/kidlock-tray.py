@@ -295,10 +295,14 @@ class KidlockTray:
                 "minutes": 15,  # Default request
                 "reason": "",
             }
-            with open(request_file, "w") as f:
+            # Write a hidden temp file and rename it into place, so the agent
+            # only ever sees complete request files
+            tmp_file = REQUEST_DIR / f".{self.username}.json.tmp"
+            with open(tmp_file, "w") as f:
                 json.dump(request_data, f)
             # Make writable by all (agent runs as root)
-            os.chmod(request_file, 0o666)
+            os.chmod(tmp_file, 0o666)
+            os.replace(tmp_file, request_file)
             self._show_message("Request Sent", "Your request for 15 extra minutes has been sent.")
         except Exception as e:
             self._show_message("Error", f"Failed to send request: {e}")
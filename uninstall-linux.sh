@@ -55,6 +55,7 @@ rm -rf /opt/kidlock
 # Remove state directory
 echo "Removing state directory..."
 rm -rf /var/lib/kidlock
+rm -rf /var/cache/kidlock
 
 # Ask about config
 echo ""